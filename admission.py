@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+admission.py -- queued registration for conferences that sell out in bursts
+
+Conferences with queuedRegistration set take no seats in the request:
+enqueue() stores the user's AdmissionTicket, a child of the Profile
+keyed by the conference, and adds a pull task carrying it to the
+"admission" queue, tagged with the conference, in one transaction on
+the user's own entity group.  A user has at most one pending ticket per
+conference; queueing again returns it.  A coalesced worker, admit(),
+leases up to ADMISSION_BATCH_SIZE tickets at a time and settles them in
+one transaction on the conference's AdmissionQueue: the head of the
+waitlist first, then the new tickets in the order they arrived, each
+getting a seat and a Registration while seats are left and joining the
+waitlist otherwise.  However many people arrive, registrations then
+cost one transaction per batch instead of a retried transaction each.
+
+The waitlist is one AdmissionWaiter per waiting user, a child of the
+AdmissionQueue keyed by its arrival sequence, so a batch reads only the
+head of it.  A waitlisted ticket keeps its sequence and the queue keeps
+the sequence of its head, so ticketStatus() is a single batch get of
+two entities.  A seat freed by unregistering is handed to the waitlist
+by scheduling the worker again.
+
+"""
+
+import json
+import time
+import uuid
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import AdmissionQueue
+from models import AdmissionTicket
+from models import AdmissionWaiter
+from models import Profile
+from models import Registration
+from models import registrationKey
+
+import seats
+
+ADMISSION_QUEUE = 'admission'
+ADMISSION_BATCH_SIZE = 10  # tickets per transaction; each adds entity groups
+ADMISSION_LEASE_SECONDS = 60
+ADMISSION_WINDOW = 1       # seconds between coalesced worker runs
+PENDING = ('QUEUED', 'WAITLISTED')
+
+
+def queueKey(conf_key):
+    return ndb.Key(AdmissionQueue, conf_key.urlsafe())
+
+
+def ticketKey(conf_key, user_id):
+    return ndb.Key(Profile, user_id, AdmissionTicket, conf_key.urlsafe())
+
+
+def waiterKey(conf_key, sequence):
+    return ndb.Key(AdmissionWaiter, sequence, parent=queueKey(conf_key))
+
+
+def enqueue(conf_key, user_id):
+    """Queue a registration of user_id; return (ticket, status), those
+    of the pending ticket when the user already has one."""
+    @ndb.transactional()
+    def _enqueue():
+        key = ticketKey(conf_key, user_id)
+        stored = key.get()
+        if stored and stored.status in PENDING:
+            return stored.ticket, stored.status, False
+        ticket = uuid.uuid4().hex
+        AdmissionTicket(key=key, ticket=ticket, status='QUEUED').put()
+        taskqueue.Queue(ADMISSION_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'ticket': ticket, 'userId': user_id}),
+            method='PULL', tag=conf_key.urlsafe()), transactional=True)
+        return ticket, 'QUEUED', True
+    ticket, status, new = _enqueue()
+    if new:
+        schedule(conf_key)
+    return ticket, status
+
+
+def schedule(conf_key, coalesce=True):
+    """Enqueue the admission worker for the conference; when coalescing,
+    requests within the same window share one task."""
+    params = {'websafeConferenceKey': conf_key.urlsafe()}
+    if not coalesce:
+        taskqueue.add(params=params, url='/tasks/admit')
+        return
+    window = int(time.time() // ADMISSION_WINDOW)
+    try:
+        taskqueue.add(params=params, url='/tasks/admit',
+            name='admit-%s-%d' % (conf_key.urlsafe(), window),
+            countdown=ADMISSION_WINDOW
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def ticketStatus(conf_key, user_id, ticket):
+    """Return (status, waitlist position or None) of a ticket of
+    user_id; (None, None) when the user holds no such ticket.  Tickets
+    the worker has not settled yet are QUEUED."""
+    queue, stored = ndb.get_multi([queueKey(conf_key),
+                                   ticketKey(conf_key, user_id)])
+    if not stored or stored.ticket != ticket:
+        return None, None
+    if stored.status == 'WAITLISTED' and queue:
+        return stored.status, max(stored.sequence - queue.head, 0) + 1
+    return stored.status, None
+
+
+@ndb.transactional(xg=True)
+def _settle(conf_key, tickets, shard_keys):
+    """Settle the waitlist head and the leased tickets in FIFO order;
+    return the number of seats granted."""
+    q_key = queueKey(conf_key)
+    queue = q_key.get() or AdmissionQueue(key=q_key)
+    waiters = AdmissionWaiter.query(ancestor=q_key).order(
+        AdmissionWaiter.key).fetch(ADMISSION_BATCH_SIZE - len(tickets)) \
+        if shard_keys else []
+    stored = ndb.get_multi(
+        [ticketKey(conf_key, waiter.userId) for waiter in waiters] +
+        [ticketKey(conf_key, t['userId']) for t in tickets])
+
+    # (waiter or None, ticket) in FIFO order; a ticket leased again
+    # after its batch committed is already settled, and a waiter whose
+    # ticket was replaced is dropped
+    candidates, removed = [], []
+    for waiter, ticket in zip(waiters, stored[:len(waiters)]):
+        if ticket and ticket.status == 'WAITLISTED' \
+                and ticket.sequence == waiter.key.id():
+            candidates.append((waiter, ticket))
+        else:
+            removed.append(waiter.key)
+    for t, ticket in zip(tickets, stored[len(waiters):]):
+        if ticket and ticket.status == 'QUEUED' \
+                and ticket.ticket == t['ticket']:
+            candidates.append((None, ticket))
+
+    users = sorted(set(ticket.key.parent().id()
+                       for _, ticket in candidates))
+    found = ndb.get_multi([registrationKey(user_id, conf_key)
+                           for user_id in users] +
+                          [ndb.Key(Profile, user_id) for user_id in users])
+    wsck = conf_key.urlsafe()
+    registered = set(user_id for user_id, reg, prof in
+                     zip(users, found[:len(users)], found[len(users):])
+                     if reg or (prof and wsck in prof.conferenceKeysToAttend))
+
+    taken, shards = 0, []
+    if shard_keys:
+        taken, shards = seats.takeSeats(shard_keys, len(users) -
+                                        len(registered))
+    granted = taken
+    registrations, added, still_waiting = [], [], []
+    for waiter, ticket in candidates:
+        user_id = ticket.key.parent().id()
+        if user_id in registered:
+            ticket.status = 'ALREADY_REGISTERED'
+        elif taken:
+            taken -= 1
+            ticket.status = 'REGISTERED'
+            registered.add(user_id)
+            registrations.append(Registration(
+                key=registrationKey(user_id, conf_key),
+                conferenceKey=conf_key))
+        elif waiter:
+            still_waiting.append(waiter.key.id())
+            continue
+        else:
+            ticket.status = 'WAITLISTED'
+            ticket.sequence = queue.nextSequence
+            queue.nextSequence += 1
+            added.append(AdmissionWaiter(
+                key=waiterKey(conf_key, ticket.sequence), userId=user_id))
+            continue
+        ticket.sequence = None
+        if waiter:
+            removed.append(waiter.key)
+
+    # the head is the first waiter left; all before it have been served
+    if still_waiting:
+        queue.head = still_waiting[0]
+    elif waiters:
+        queue.head = waiters[-1].key.id() + 1
+    settled = [ticket for waiter, ticket in candidates
+               if not waiter or ticket.status != 'WAITLISTED']
+    ndb.put_multi([queue] + settled + registrations + shards + added)
+    ndb.delete_multi(removed)
+    return granted - taken
+
+
+def admit(conf_key):
+    """Settle one batch of queued tickets; chain another run while full
+    batches keep coming.  Return the number of seats granted."""
+    conf = conf_key.get()
+    if not conf:
+        return 0
+    conf = seats.ensureShards(conf)
+    shard_keys = seats.candidateShards(conf)
+    queue = queueKey(conf_key).get()
+    waiting = min(queue.nextSequence - queue.head, ADMISSION_BATCH_SIZE) \
+        if queue and shard_keys else 0
+
+    pull = taskqueue.Queue(ADMISSION_QUEUE)
+    leased = []
+    if waiting < ADMISSION_BATCH_SIZE:
+        leased = pull.lease_tasks_by_tag(ADMISSION_LEASE_SECONDS,
+            ADMISSION_BATCH_SIZE - waiting, tag=conf_key.urlsafe())
+    if not leased and not waiting:
+        return 0
+
+    try:
+        granted = _settle(conf_key, [json.loads(task.payload)
+                                     for task in leased], shard_keys)
+    except Exception:
+        # hand the tickets back so the retry of this task can lease them
+        for task in leased:
+            pull.modify_task_lease(task, 0)
+        raise
+    if leased:
+        pull.delete_tasks(leased)
+    if granted:
+        seats.scheduleReconcile(conf_key)
+    if len(leased) + waiting == ADMISSION_BATCH_SIZE and (leased or granted):
+        schedule(conf_key, coalesce=False)
+    return granted
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- "nearly sold out" announcement maintained on write
+
+The set of nearly sold out conferences lives in a single durable
+Announcement entity and is mirrored into memcache as the rendered text.
+update() is called whenever a Conference's seatsAvailable may have
+changed and only writes when the conference enters or leaves the set,
+so the announcement is current without periodic scans; rebuild() is a
+full-scan repair used by the cron job.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Announcement
+from models import Conference
+
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_ANNOUNCEMENTS_TTL = 300
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+ANNOUNCEMENT_KEY = ndb.Key(Announcement, 'nearlySoldOut')
+
+
+def isNearlySoldOut(conf):
+    return 0 < (conf.seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def _render(announcement):
+    """Return the announcement text; "" when nothing is nearly sold out."""
+    conferences = announcement.conferences if announcement else None
+    if not conferences:
+        return ""
+    return ANNOUNCEMENT_TPL % ', '.join(sorted(conferences.values()))
+
+
+def _mirror(announcement):
+    """Copy the rendered announcement into memcache and return it."""
+    text = _render(announcement)
+    memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, text,
+                 time=MEMCACHE_ANNOUNCEMENTS_TTL)
+    return text
+
+
+def get():
+    """Return the announcement text, from memcache or else from the
+    Announcement entity."""
+    return getAsync().get_result()
+
+
+@ndb.tasklet
+def getAsync():
+    """Tasklet version of get()."""
+    text = yield ndb.get_context().memcache_get(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if text is None:
+        announcement = yield ANNOUNCEMENT_KEY.get_async()
+        text = _mirror(announcement)
+    raise ndb.Return(text)
+
+
+def update(conf):
+    """Add conf to or remove it from the announcement if it crossed the
+    nearly sold out threshold (or was renamed while listed).  The
+    decision is made on the Conference as re-read in the transaction, so
+    a stale copy passed in cannot undo a newer update."""
+    conf_key = conf.key
+    wsck = conf_key.urlsafe()
+
+    @ndb.transactional(xg=True)
+    def _update():
+        current, announcement = ndb.get_multi([conf_key, ANNOUNCEMENT_KEY])
+        name = current.name if current and isNearlySoldOut(current) else None
+        announcement = announcement or Announcement(key=ANNOUNCEMENT_KEY)
+        conferences = dict(announcement.conferences or {})
+        if conferences.get(wsck) == name:
+            return None
+        if name:
+            conferences[wsck] = name
+        else:
+            conferences.pop(wsck, None)
+        announcement.conferences = conferences
+        announcement.put()
+        return announcement
+    announcement = _update()
+    if announcement:
+        _mirror(announcement)
+
+
+def rebuild():
+    """Recompute the announcement from every Conference and return its
+    text; repairs any update that was missed."""
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+
+    announcement = Announcement(key=ANNOUNCEMENT_KEY, conferences=dict(
+        (conf.key.urlsafe(), conf.name) for conf in confs))
+    announcement.put()
+    return _mirror(announcement)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+bench_api.py -- latency and RPC counts of the ConferenceApi endpoints
+
+Builds a deterministic synthetic dataset on the testbed stubs at each
+scale, calls every benchmarked endpoint --repeat times as a signed-in
+user and writes p50/p95 latency and the average number of datastore and
+memcache RPCs per call to a JSON report, so runs on two commits can be
+compared.  A scale is a number of conferences; profiles, speakers and
+sessions grow with it.
+
+usage: python benchmarks/bench_api.py --sdk PATH_TO_APPENGINE_SDK
+           [--scales 10,100,1000] [--repeat 20] [--seed 1]
+           [--sessions-per-conference 20] [--wishlist-density 0.01]
+           [--registration-density 0.05] [--output report.json]
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date
+from datetime import time as dtime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CITIES = ['London', 'Chicago', 'Paris', 'Tokyo', 'San Francisco']
+TOPICS = ['Medical Innovations', 'Programming Languages',
+          'Web Technologies', 'Movie Making']
+SESSION_TYPES = ['Lecture', 'Workshop', 'Keynote', 'Other']
+MAX_WISHLIST = 50
+REGISTRANT = 'registrant@example.com'
+
+
+def setupPath(sdk):
+    """Make the App Engine SDK and the app importable."""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+
+def setupTestbed():
+    """Activate fresh, strongly consistent service stubs."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_app_identity_stub()
+    bed.init_user_stub()
+    return bed
+
+
+class RpcCounter(object):
+    """RpcCounter -- counts API calls made through the apiproxy"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def __call__(self, service, call, request, response):
+        if service in ('datastore_v3', 'memcache'):
+            self.counts['%s.%s' % (service, call)] += 1
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'bench_rpc_counter', self)
+
+
+# - - - synthetic data - - - - - - - - - - - - - - - - - - - -
+
+def makeDataset(scale, args):
+    """Store scale conferences with their organizers, speakers, sessions,
+    registrations and wishlists; return the keys the cases need."""
+    from google.appengine.ext import ndb
+    from conference import ConferenceApi
+    from models import Conference, Profile, Session, Speaker
+    import seats
+
+    rnd = random.Random(args.seed)
+    profiles = [Profile(key=ndb.Key(Profile, 'user%d@example.com' % i),
+                        displayName='User %d' % i,
+                        mainEmail='user%d@example.com' % i)
+                for i in range(scale)]
+    # ids come from the stub's allocator so endpoints never reuse them
+    first = Speaker.allocate_ids(size=scale // 2 + 1)[0]
+    speakers = [Speaker(key=ndb.Key(Speaker, first + i),
+                        name='Speaker %d' % i)
+                for i in range(scale // 2 + 1)]
+    ndb.put_multi(speakers)
+
+    conferences, sessions = [], []
+    for i in range(scale):
+        organizer = profiles[rnd.randrange(len(profiles))]
+        start = date(2030, 1 + i % 12, 1 + i % 28)
+        c_id = Conference.allocate_ids(size=1, parent=organizer.key)[0]
+        conferences.append(Conference(
+            key=ndb.Key(Conference, c_id, parent=organizer.key),
+            name='Conference %d' % i, description='Synthetic',
+            organizerUserId=organizer.key.id(),
+            organizerDisplayName=organizer.displayName,
+            topics=rnd.sample(TOPICS, 2), city=rnd.choice(CITIES),
+            startDate=start, month=start.month, endDate=start,
+            maxAttendees=scale * 2, seatsAvailable=scale * 2))
+
+    # registrations before the seat shards are built from seatsAvailable
+    attendees = int(round(args.registration_density * scale))
+    for conf in conferences:
+        for profile in rnd.sample(profiles, attendees):
+            profile.conferenceKeysToAttend.append(conf.key.urlsafe())
+        conf.seatsAvailable -= attendees
+        seats.putWithShards(conf)
+
+    for conf in conferences:
+        batch = []
+        if args.sessions_per_conference:
+            first = Session.allocate_ids(size=args.sessions_per_conference,
+                                         parent=conf.key)[0]
+        for j in range(args.sessions_per_conference):
+            batch.append(Session(
+                key=ndb.Key(Session, first + j, parent=conf.key),
+                conferenceKey=conf.key, name='%s session %d' % (conf.name, j),
+                speakerKey=rnd.choice(speakers).key, duration=1.0,
+                typeOfSession=rnd.choice(SESSION_TYPES), date=conf.startDate,
+                startTime=dtime(8 + j % 12, 0)))
+        if batch:
+            ConferenceApi._putSessionsAndCounts(batch, conf.name,
+                dict((s.key, s.name) for s in speakers), seed=False)
+        sessions.extend(batch)
+
+    wishlist = min(MAX_WISHLIST,
+                   int(round(args.wishlist_density * len(sessions))))
+    for profile in profiles:
+        profile.sessionWishlist = [s.key for s in
+                                   rnd.sample(sessions, wishlist)]
+    ndb.put_multi(profiles)
+
+    return {
+        'user': profiles[0],
+        'organizer': conferences[0].organizerUserId,
+        'conference': conferences[0].key.urlsafe(),
+        'speaker': speakers[0].key.urlsafe(),
+        'session': sessions[0].key.urlsafe() if sessions else None,
+    }
+
+
+# - - - endpoint calls - - - - - - - - - - - - - - - - - - - -
+
+def call(name, user, **fields):
+    """Call endpoint name of a ConferenceApi as user, bypassing the
+    Endpoints request plumbing."""
+    import endpoints
+    from google.appengine.api import users
+    from conference import ConferenceApi
+
+    endpoints.get_current_user = lambda: users.User(user)
+    method = getattr(ConferenceApi, name).remote
+    return method.method(ConferenceApi(), method.request_type(**fields))
+
+
+def makeCases(data):
+    """Return the (name, callable) pairs to time."""
+    from models import ConferenceQueryForm, SessionType
+    from conference import ConferenceApi
+
+    user = data['user'].key.id()
+    organizer = data['organizer']
+    conference = data['conference']
+    city = ConferenceQueryForm(field='CITY', operator='EQ', value='London')
+    topic = ConferenceQueryForm(field='TOPIC', operator='EQ',
+                                value='Web Technologies')
+
+    def registration():
+        # one register/unregister cycle: two seat transactions, by a
+        # user the dataset never registers
+        call('registerForConference', REGISTRANT,
+             websafeConferenceKey=conference)
+        call('unregisterFromConference', REGISTRANT,
+             websafeConferenceKey=conference)
+
+    def createAndDeleteSession():
+        form = call('createSession', organizer, name='Benchmark session',
+                    websafeConferenceKey=conference,
+                    websafeSpeakerKey=data['speaker'],
+                    date='2030-01-01', startTime='10:00')
+        call('deleteSession', organizer, websafeSessionKey=form.websafeKey)
+
+    return [
+        ('getConference', lambda: call('getConference', user,
+            websafeConferenceKey=conference)),
+        ('queryConferences', lambda: call('queryConferences', user,
+            filters=[city, topic])),
+        ('getConferencesCreated', lambda: call('getConferencesCreated',
+            organizer)),
+        ('getConferencesToAttend', lambda: call('getConferencesToAttend',
+            user)),
+        ('getConferenceSessions', lambda: call('getConferenceSessions',
+            user, websafeConferenceKey=conference)),
+        ('getConferenceSessionsByType', lambda: call(
+            'getConferenceSessionsByType', user,
+            websafeConferenceKey=conference,
+            typeOfSession=SessionType.Lecture)),
+        ('getSessionsInWishlist', lambda: call('getSessionsInWishList',
+            user)),
+        ('nonWorkshopSessionsBefore7', lambda: call(
+            'nonWorkshopSessionsBefore7', user)),
+        ('querySessions', lambda: call('querySessions', user,
+            filters=[ConferenceQueryForm(field='TYPE',
+                                         operator='EQ', value='Lecture')])),
+        ('getProfile', lambda: call('getProfile', user)),
+        ('getFeaturedSpeaker', lambda: call('getFeaturedSpeaker', user)),
+        ('featureSpeakerTask', lambda: ConferenceApi._featureSpeaker(
+            data['speaker'], conference)),
+        ('registration', registration),
+        ('createAndDeleteSession', createAndDeleteSession),
+    ]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(0, int(round(fraction * len(ordered))) - 1)]
+
+
+def timeCase(fn, repeat, counter):
+    """Run fn repeat times; return latency percentiles and RPCs/call."""
+    latencies = []
+    counter.counts.clear()
+    for i in range(repeat):
+        # every call is a new request for the request-scoped caches
+        os.environ['REQUEST_LOG_ID'] = '%d-%f' % (i, time.time())
+        start = time.time()
+        fn()
+        latencies.append((time.time() - start) * 1000)
+    return {
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'rpcs_per_call': dict((name, round(count / float(repeat), 2))
+                              for name, count in counter.counts.items()),
+    }
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--scales', default='10,100,1000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sessions-per-conference', type=int, default=20)
+    parser.add_argument('--wishlist-density', type=float, default=0.01)
+    parser.add_argument('--registration-density', type=float, default=0.05)
+    parser.add_argument('--output', default='bench_api.json')
+    args = parser.parse_args()
+    setupPath(args.sdk)
+    import cache
+
+    report = {'revision': gitRevision(), 'args': vars(args), 'scales': {}}
+    for scale in [int(s) for s in args.scales.split(',')]:
+        bed = setupTestbed()
+        cache._local.clear()  # entity keys repeat between scales
+        counter = RpcCounter()
+        counter.install()
+        data = makeDataset(scale, args)
+        results = report['scales'][scale] = {}
+        print('scale %d' % scale)
+        print('  %-28s %10s %10s %8s' % ('case', 'p50 (ms)', 'p95 (ms)',
+                                         'rpcs'))
+        for name, fn in makeCases(data):
+            results[name] = timeCase(fn, args.repeat, counter)
+            print('  %-28s %10.2f %10.2f %8.1f' % (
+                name, results[name]['p50_ms'], results[name]['p95_ms'],
+                sum(results[name]['rpcs_per_call'].values())))
+        bed.deactivate()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('report written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+bench_mailer.py -- throughput of the batched mailer against an SMTP sink
+
+Queues --count confirmation emails on a stubbed "mail" pull queue and
+drains them through the SMTP backend, printing messages per second.
+Start a sink first, e.g.
+    python -m smtpd -n -c DebuggingServer localhost:1025 > /dev/null
+
+usage: python benchmarks/bench_mailer.py --sdk PATH_TO_APPENGINE_SDK
+           [--count 1000] [--host localhost] [--port 1025]
+
+"""
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def setupPath(sdk):
+    """Make the App Engine SDK and the app importable."""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+    setupPath(args.sdk)
+
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_app_identity_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+
+    import mailer
+    for i in range(args.count):
+        mailer.send('conferenceCreated', 'user%d@example.com' % i,
+                    displayName='User %d' % i, name='Conference %d' % i,
+                    description='Description', city='London',
+                    topics='Web Technologies', startDate='2016-01-01',
+                    endDate='2016-01-02', maxAttendees=100)
+
+    backend = mailer.SMTPBackend(args.host, args.port)
+    totals = {'sent': 0, 'seconds': 0.0}
+    while True:
+        report = mailer.drain(backend)
+        if not report['sent']:
+            break
+        totals['sent'] += report['sent']
+        totals['seconds'] += report['seconds']
+    bed.deactivate()
+
+    print('%d messages in %.2fs: %.1f msg/s' % (
+        totals['sent'], totals['seconds'],
+        totals['sent'] / totals['seconds'] if totals['seconds'] else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+bench_mappers.py -- per-entity cost of copying entities into forms
+
+Compares the reflective field loops the _copy*ToForm methods used to run
+with the compiled FormMappers from mappers.py, on in-memory entities
+(no datastore calls are made).
+
+usage: python benchmarks/bench_mappers.py --sdk PATH_TO_APPENGINE_SDK
+           [--count 10000] [--repeat 3]
+
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+from datetime import time as dtime
+
+
+def setupPath(sdk):
+    """Make the App Engine SDK and the app importable."""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+
+# - - - reflective copies, as the API ran them before mappers - - - -
+
+def legacyConferenceToForm(conf):
+    from models import ConferenceForm
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def legacySessionToForm(session):
+    from models import SessionForm
+    from models import SessionType
+    form = SessionForm()
+    setattr(form, 'websafeKey', session.key.urlsafe())
+    for field in form.all_fields():
+        if hasattr(session, field.name):
+            if field.name == 'typeOfSession':
+                if getattr(session, field.name) in ('', None):
+                    setattr(form, field.name, 'Other')
+                else:
+                    setattr(form, field.name, getattr(SessionType,
+                        getattr(session, field.name)))
+            elif field.name in ('conferenceKey', 'speakerKey'):
+                value = getattr(session, field.name)
+                setattr(form, field.name,
+                    value.urlsafe() if value is not None else '')
+            elif field.name in ('startTime', 'date'):
+                setattr(form, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(form, field.name, getattr(session, field.name))
+    form.check_initialized()
+    return form
+
+
+def makeEntities(count):
+    """Build count Conferences and count Sessions in memory."""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import Speaker
+
+    speaker_key = ndb.Key(Speaker, 1)
+    conferences, sessions = [], []
+    for i in range(count):
+        p_key = ndb.Key(Profile, 'user%d@example.com' % (i % 100))
+        conf = Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+            name='Conference %d' % i, description='Description',
+            organizerUserId=p_key.id(), organizerDisplayName='User',
+            topics=['Web Technologies', 'Movie Making'], city='London',
+            startDate=date(2016, 1 + i % 12, 1), month=1 + i % 12,
+            endDate=date(2016, 1 + i % 12, 2), maxAttendees=100,
+            seatsAvailable=50)
+        conferences.append(conf)
+        sessions.append(Session(key=ndb.Key(Session, i + 1, parent=conf.key),
+            conferenceKey=conf.key, name='Session %d' % i,
+            highlights='Highlights', speakerKey=speaker_key, duration=1.5,
+            typeOfSession='Lecture', date=date(2016, 1, 1),
+            startTime=dtime(10, 0)))
+    return conferences, sessions
+
+
+def timeCopies(copy, entities, repeat):
+    """Return the best per-entity time of copy over entities, in us."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for entity in entities:
+            copy(entity)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(entities) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    setupPath(args.sdk)
+
+    import conference
+    conferences, sessions = makeEntities(args.count)
+    cases = [
+        ('Conference', legacyConferenceToForm,
+            conference.CONFERENCE_MAPPER, conferences),
+        ('Session', legacySessionToForm,
+            conference.SESSION_MAPPER, sessions),
+    ]
+    print('%-12s %12s %12s %8s' % ('entity', 'before (us)', 'after (us)',
+                                   'speedup'))
+    for name, legacy, mapper, entities in cases:
+        before = timeCopies(legacy, entities, args.repeat)
+        after = timeCopies(mapper, entities, args.repeat)
+        print('%-12s %12.2f %12.2f %7.1fx' % (name, before, after,
+                                              before / after))
+
+
+if __name__ == '__main__':
+    main()
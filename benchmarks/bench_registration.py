@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""
+bench_registration.py -- concurrent registrations for one conference
+
+Starts --threads workers on the testbed stubs that register --registrants
+users for one conference with --seats seats, first against a single
+seatsAvailable counter on the Conference (the unsharded baseline) and
+then through the seat shards.  A sampler thread reads the seat counts
+while the workers run.  Each mode asserts that no count ever went below
+zero and that registrations never exceeded maxAttendees, and reports
+registrations per second; the report ends with the sharded speedup.
+
+usage: python benchmarks/bench_registration.py --sdk PATH_TO_APPENGINE_SDK
+           [--registrants 500] [--seats 400] [--threads 20]
+           [--output bench_registration.json]
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ATTEMPTS = 10  # per registrant, when its transactions keep colliding
+
+
+def setupPath(sdk):
+    """Make the App Engine SDK and the app importable."""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+
+def setupTestbed():
+    """Activate fresh service stubs that detect transaction collisions."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    return bed
+
+
+class SoldOut(Exception):
+    """Raised when no seat is left."""
+
+
+# - - - registration paths - - - - - - - - - - - - - - - - - - -
+
+def registerUnsharded(user_id, conf_key):
+    """Baseline: every registration decrements Conference.seatsAvailable."""
+    from google.appengine.ext import ndb
+    from models import Registration
+    from models import registrationKey
+
+    @ndb.transactional(xg=True)
+    def _register():
+        reg_key = registrationKey(user_id, conf_key)
+        conf, registration = ndb.get_multi([conf_key, reg_key])
+        if registration:
+            return
+        if conf.seatsAvailable <= 0:
+            raise SoldOut()
+        conf.seatsAvailable -= 1
+        ndb.put_multi([conf, Registration(key=reg_key,
+                                          conferenceKey=conf_key)])
+    _register()
+
+
+def registerSharded(user_id, conf_key):
+    """The registerForConference path: take a seat from any shard."""
+    from conference import ConferenceApi
+    import seats
+
+    conf = conf_key.get()
+    for shard_key in seats.candidateShards(conf):
+        try:
+            ConferenceApi()._takeSeat(user_id, conf_key, shard_key)
+            return
+        except seats.ShardExhausted:
+            continue
+    raise SoldOut()
+
+
+def seatCounts(conf_key, sharded):
+    """Return the seat counts the invariants are checked on."""
+    from google.appengine.ext import ndb
+    import seats
+
+    conf = conf_key.get()
+    if not sharded:
+        return [conf.seatsAvailable]
+    return [shard.seatsAvailable
+            for shard in ndb.get_multi(seats.shardKeys(conf))]
+
+
+# - - - run - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def makeConference(args, sharded):
+    from google.appengine.ext import ndb
+    from models import Conference, Profile
+    import seats
+
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    conf = Conference(key=ndb.Key(Conference, 1, parent=organizer),
+                      name='Hot conference', maxAttendees=args.seats,
+                      seatsAvailable=args.seats)
+    if sharded:
+        seats.putWithShards(conf)
+    else:
+        conf.put()
+    ndb.put_multi([Profile(key=ndb.Key(Profile, 'user%d@example.com' % i))
+                   for i in range(args.registrants)])
+    return conf.key
+
+
+def runMode(args, sharded):
+    """Register every registrant concurrently; return the results."""
+    from google.appengine.api import datastore_errors
+    from models import Registration
+
+    bed = setupTestbed()
+    conf_key = makeConference(args, sharded)
+    register = registerSharded if sharded else registerUnsharded
+    pending = ['user%d@example.com' % i for i in range(args.registrants)]
+    lock = threading.Lock()
+    totals = {'registered': 0, 'soldOut': 0, 'failed': 0, 'collisions': 0}
+    lowest = [min(seatCounts(conf_key, sharded))]
+    running = [True]
+
+    def count(name, n=1):
+        with lock:
+            totals[name] += n
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                user_id = pending.pop()
+            for _ in range(ATTEMPTS):
+                try:
+                    register(user_id, conf_key)
+                    count('registered')
+                    break
+                except SoldOut:
+                    count('soldOut')
+                    break
+                except datastore_errors.TransactionFailedError:
+                    count('collisions')
+            else:
+                count('failed')
+
+    def sampler():
+        while running[0]:
+            lowest[0] = min(lowest[0], min(seatCounts(conf_key, sharded)))
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    watch = threading.Thread(target=sampler)
+    start = time.time()
+    watch.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    running[0] = False
+    watch.join()
+
+    left = seatCounts(conf_key, sharded)
+    registrations = Registration.query(
+        Registration.conferenceKey == conf_key).count()
+    bed.deactivate()
+
+    assert lowest[0] >= 0 and min(left) >= 0, 'seat count went below zero'
+    assert registrations <= args.seats, 'more registrations than seats'
+    assert registrations == totals['registered']
+    assert registrations + sum(left) == args.seats, 'seats were lost'
+    return dict(totals, registrations=registrations,
+                seatsLeft=sum(left), lowestSeatCount=lowest[0],
+                seconds=round(elapsed, 3),
+                perSecond=round(registrations / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--registrants', type=int, default=500)
+    parser.add_argument('--seats', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--output', default='bench_registration.json')
+    args = parser.parse_args()
+    setupPath(args.sdk)
+
+    report = {'args': vars(args)}
+    for mode, sharded in (('unsharded', False), ('sharded', True)):
+        report[mode] = runMode(args, sharded)
+        print('%-10s %6d registered %6d sold out %6d collisions '
+              '%6d failed %8.1f/s' % (mode, report[mode]['registrations'],
+              report[mode]['soldOut'], report[mode]['collisions'],
+              report[mode]['failed'], report[mode]['perSecond']))
+    baseline = report['unsharded']['perSecond']
+    report['speedup'] = round(report['sharded']['perSecond'] / baseline, 2) \
+        if baseline else None
+    print('sharded speedup: %sx' % report['speedup'])
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('report written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
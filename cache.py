@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- two-tier read-through cache for datastore entities
+
+Reads go to a bounded per-instance LRU first, then memcache, then the
+datastore.  Every memcache entry is tagged with the generation counter
+of its key; invalidate() bumps the counter so entries written before the
+write are never served again, even if a slow reader stores them late.
+
+Cached entities are shared between requests of an instance and must be
+treated as read-only; write paths read through ndb directly.
+getAsync() is the tasklet form: concurrent lookups share one memcache
+and one datastore batch.
+
+getVersioned()/setVersioned() apply the same scheme to whole responses:
+entries are tagged with the version of a namespace (e.g. the sessions
+of one conference) and bumpVersion() retires all of them at once.
+
+"""
+
+import collections
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from settings import ENTITY_CACHE_SIZE
+from settings import ENTITY_CACHE_TTL
+from settings import ENTITY_MEMCACHE_TTL
+
+MEMCACHE_GENERATION_KEY = 'ENTITY_GENERATION:%s'
+MEMCACHE_ENTITY_KEY = 'ENTITY:%s'
+MEMCACHE_VERSION_KEY = 'VERSION:%s'
+RESPONSE_MEMCACHE_TTL = 3600
+
+
+class LRUCache(object):
+    """LRUCache -- bounded, thread-safe LRU mapping with entry expiry"""
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or None."""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = item
+            return item[1]
+
+    def set(self, key, value):
+        """Store value, evicting the least recently used entries."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self._ttl, value)
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = LRUCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+_stats = collections.Counter()
+
+
+def _newGeneration():
+    """Starting value for a generation counter missing from memcache;
+    time based so it never repeats an evicted counter's values."""
+    return int(time.time() * 1000)
+
+
+def _getTagged(generation_key, entry_key):
+    """Read a generation counter and a tagged entry in one memcache
+    call; return (value, generation), value None unless the entry is
+    tagged with the current generation."""
+    cached = memcache.get_multi([generation_key, entry_key])
+    generation = cached.get(generation_key)
+    if generation is None:
+        generation = _newGeneration()
+        if not memcache.add(generation_key, generation):
+            generation = memcache.get(generation_key)
+
+    entry = cached.get(entry_key)
+    if generation is not None and entry is not None \
+            and entry[0] == generation:
+        return entry[1], generation
+    return None, generation
+
+
+def _bump(generation_key):
+    memcache.incr(generation_key, initial_value=_newGeneration())
+
+
+def get(key):
+    """Return the entity for key, or None if it does not exist."""
+    return getAsync(key).get_result()
+
+
+@ndb.tasklet
+def getAsync(key):
+    """Tasklet version of get().  Its memcache and datastore calls go
+    through the ndb context, so lookups of several keys running at the
+    same time are batched into one round trip of each."""
+    if ndb.in_transaction():
+        # transactional reads must see (and lock) the datastore entity
+        entity = yield key.get_async()
+        raise ndb.Return(entity)
+
+    urlsafe = key.urlsafe()
+    entity = _local.get(urlsafe)
+    if entity is not None:
+        _stats['localHits'] += 1
+        raise ndb.Return(entity)
+
+    ctx = ndb.get_context()
+    generation_key = MEMCACHE_GENERATION_KEY % urlsafe
+    entity_key = MEMCACHE_ENTITY_KEY % urlsafe
+    generation, entry = yield (ctx.memcache_get(generation_key),
+                               ctx.memcache_get(entity_key))
+    if generation is None:
+        generation = _newGeneration()
+        added = yield ctx.memcache_add(generation_key, generation)
+        if not added:
+            generation = yield ctx.memcache_get(generation_key)
+    if generation is not None and entry is not None \
+            and entry[0] == generation:
+        _stats['memcacheHits'] += 1
+        _local.set(urlsafe, entry[1])
+        raise ndb.Return(entry[1])
+
+    _stats['misses'] += 1
+    entity = yield key.get_async()
+    if entity is not None and generation is not None:
+        yield ctx.memcache_set(entity_key, (generation, entity),
+                               time=ENTITY_MEMCACHE_TTL)
+        _local.set(urlsafe, entity)
+    raise ndb.Return(entity)
+
+
+def invalidate(*keys):
+    """Invalidate cached copies of the given keys; inside a transaction
+    this happens once the transaction commits."""
+    if ndb.in_transaction():
+        ndb.get_context().call_on_commit(lambda: invalidate(*keys))
+        return
+
+    for key in keys:
+        urlsafe = key.urlsafe()
+        _local.delete(urlsafe)
+        _bump(MEMCACHE_GENERATION_KEY % urlsafe)
+        _stats['invalidations'] += 1
+
+
+def getVersioned(namespace, name):
+    """Return (value, version) for a response cached under name; value
+    is None unless it was stored at the namespace's current version."""
+    value, version = _getTagged(MEMCACHE_VERSION_KEY % namespace, name)
+    _stats['responseHits' if value is not None else 'responseMisses'] += 1
+    return value, version
+
+
+def setVersioned(name, version, value):
+    """Cache a response computed at the given namespace version."""
+    if version is not None:
+        memcache.set(name, (version, value), time=RESPONSE_MEMCACHE_TTL)
+
+
+def bumpVersion(namespace):
+    """Retire every response cached in the namespace; inside a
+    transaction this happens once the transaction commits."""
+    if ndb.in_transaction():
+        ndb.get_context().call_on_commit(lambda: bumpVersion(namespace))
+        return
+    _bump(MEMCACHE_VERSION_KEY % namespace)
+
+
+def stats():
+    """Return the hit, miss and invalidation counters of this instance."""
+    return dict(_stats)
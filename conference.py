@@ -16,21 +16,41 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 from datetime import datetime
 from datetime import date
 from datetime import time
+import collections
+import hashlib
+
+import time as clock
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
+from models import AttendeeForm
+from models import AttendeeForms
 from models import ConflictException
+from models import DashboardForm
+from models import ImportForm
+from models import ImportJob
+from models import ImportStatusForm
+from models import nextVersion
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import Registration
+from models import registrationKey
 from models import StringMessage
+from models import TicketForm
+from models import TicketStatus
+from models import WishlistForm
 from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
@@ -41,10 +61,12 @@ from models import TeeShirtSize
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionQueryForms
 from models import SessionType
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerSessions
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -53,12 +75,32 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+import admission
+import announcements
+import cache
+import importer
+import mailer
+import metrics
+import profiler
+import profiles
+import seats
+from mappers import FormMapper
+from planner import Filter
+from planner import QueryPlanner
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKER = "FEATURED_SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+MEMCACHE_SESSIONS_KEY = "SESSIONS:%s:%s"
+SESSIONS_NAMESPACE = "SESSIONS:%s"
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+ORGANIZER_UPDATE_BATCH_SIZE = 100
+WISHLIST_CLEANUP_BATCH_SIZE = 100
+MAX_WISHLIST_BATCH = 100  # session keys per batch wishlist request
+FEATURE_SPEAKER_WINDOW = 10 # seconds within which feature tasks collapse
+IMPORT_BATCH_SIZE = 200
+REGISTRATION_MIGRATION_BATCH_SIZE = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -66,6 +108,7 @@ DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": [ "Default", "Topic" ],
+    "queuedRegistration": False,
 }
 
 SESSION_DEFAULTS = {
@@ -84,6 +127,15 @@ OPERATORS = {
             'NE':   '!='
             }
 
+CONFERENCE_MAPPER = FormMapper(Conference, ConferenceForm)
+PROFILE_MAPPER = FormMapper(Profile, ProfileForm)
+ATTENDEE_MAPPER = FormMapper(Profile, AttendeeForm)
+SESSION_MAPPER = FormMapper(Session, SessionForm, converters={
+    'conferenceKey': lambda key: key.urlsafe() if key else '',
+    'speakerKey': lambda key: key.urlsafe() if key else '',
+})
+SPEAKER_MAPPER = FormMapper(Speaker, SpeakerForm)
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -91,15 +143,80 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+SESSION_FIELDS = {
+            'NAME': 'name',
+            'TYPE': 'typeOfSession',
+            'SPEAKER': 'speakerKey',
+            'DATE': 'date',
+            'START_TIME': 'startTime',
+            'DURATION': 'duration',
+            }
+
+# convert filter values from strings to the property's type
+FIELD_CONVERTERS = {
+            'month': int,
+            'maxAttendees': int,
+            'speakerKey': lambda value: ndb.Key(urlsafe=value),
+            'date': lambda value: datetime.strptime(
+                value[:10], "%Y-%m-%d").date(),
+            'startTime': lambda value: datetime.strptime(
+                value, "%H:%M").time(),
+            'duration': float,
+            }
+
+CONFERENCE_PLANNER = QueryPlanner(Conference, order=[Conference.name])
+SESSION_PLANNER = QueryPlanner(Session)
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_ETAG_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    etag=messages.StringField(2),
+)
+
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    etag=messages.StringField(4),
+)
+
+CONF_ATTENDEES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ticket=messages.StringField(2),
+)
+
 CONF_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
-    typeOfSession=messages.EnumField(SessionType, 2)
+    typeOfSession=messages.EnumField(SessionType, 2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+    etag=messages.StringField(5),
+)
+
+ETAG_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    etag=messages.StringField(1),
+)
+
+PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
 )
 
 SPEAKER_REQUEST = endpoints.ResourceContainer(
@@ -107,6 +224,19 @@ SPEAKER_REQUEST = endpoints.ResourceContainer(
     websafeSpeakerKey=messages.StringField(1)
 )
 
+SPEAKER_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSpeakerKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+SPEAKER_NAME_REQUEST = endpoints.ResourceContainer(
+    StringMessage,
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -123,6 +253,11 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeSpeakerKey=messages.StringField(2)
 )
 
+IMPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeImportKey=messages.StringField(1),
+)
+
 SESSION_DELETE_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1)
@@ -138,6 +273,11 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1)
 )
 
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    sortByDate=messages.BooleanField(1)
+)
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -149,26 +289,74 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+# - - - Paging - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _pageParams(self, request):
+        """Return (pageSize, start cursor) from the request's
+        pageSize/pageToken."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise endpoints.BadRequestException(
+                "'pageSize' must be a positive number")
+        page_size = min(page_size, MAX_PAGE_SIZE)
+
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException(
+                    'Invalid pageToken: %s' % request.pageToken)
+        return page_size, cursor
+
+
+    def _fetchPage(self, query, request):
+        """Fetch one page of query results using the request's
+        pageSize/pageToken; return (results, nextPageToken)."""
+        page_size, cursor = self._pageParams(request)
+        results, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=cursor)
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return results, next_token
+
+
+    def _fetchPlannedPage(self, planner, plan, request):
+        """Fetch one page of a QueryPlanner plan using the request's
+        pageSize/pageToken; return (results, nextPageToken)."""
+        page_size, cursor = self._pageParams(request)
+        results, next_cursor, more = planner.fetchPage(
+            plan, page_size, start_cursor=cursor)
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return results, next_token
+
+
+# - - - ETags - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _etag(*parts):
+        """Return the ETag of a response built from the given versions
+        and request parameters."""
+        return '"%s"' % hashlib.md5('|'.join(
+            str(part) for part in parts)).hexdigest()
+
+
+    def _stringWithEtag(self, data, request):
+        """Return data as a StringMessage with its ETag, empty when the
+        etag sent is still current."""
+        etag = self._etag(hashlib.md5(data.encode('utf-8')).hexdigest())
+        if request.etag == etag:
+            return StringMessage(data='', etag=etag, notModified=True)
+        return StringMessage(data=data, etag=etag)
+
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return CONFERENCE_MAPPER(conf)
 
 
+    @ndb.synctasklet
     def _createConferenceObject(self, request):
         """Create or update Conference object, 
         returning ConferenceForm/request."""
@@ -176,7 +364,13 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        # generate Profile Key based on user ID and allocate the Conference
+        # ID while the Profile loads
         user_id = getUserId(user)
+        p_key = ndb.Key(Profile, user_id)
+        c_ids, prof = yield (
+            Conference.allocate_ids_async(size=1, parent=p_key),
+            self._getProfileFromUserAsync())
 
         if not request.name:
             raise endpoints.BadRequestException(
@@ -187,6 +381,8 @@ class ConferenceApi(remote.Service):
             for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -208,25 +404,30 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        # get Conference key from the allocated ID
+        c_key = ndb.Key(Conference, c_ids[0], parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
-        return request
+        # store organizer name on the Conference so reads skip the Profile
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            prof.displayName
+
+        # create Conference with its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = seats.putWithShards(Conference(**data))
+        mail = mailer.sendAsync('conferenceCreated', user.email(),
+            displayName=prof.displayName or user.email(),
+            name=conf.name, description=conf.description or '',
+            city=conf.city or '', topics=', '.join(conf.topics or []),
+            startDate=str(conf.startDate or ''),
+            endDate=str(conf.endDate or ''),
+            maxAttendees=conf.maxAttendees or 0)
+        announcements.update(conf)
+        yield mail
+        raise ndb.Return(request)
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -251,7 +452,13 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees or 0
         for field in request.all_fields():
+            # organizer name is maintained from the Profile and seats from
+            # the seat shards, never from the form
+            if field.name in ('organizerDisplayName', 'seatsAvailable',
+                              'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -262,9 +469,26 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # add or remove the change in maxAttendees from the free seats
+        delta = (conf.maxAttendees or 0) - oldMaxAttendees
+        if delta:
+            if conf.seatShards:
+                shards = seats.resizeShards(conf, delta)
+                if shards is None:
+                    raise ConflictException(
+                        'maxAttendees is lower than the number of attendees')
+                ndb.put_multi(shards)
+                ndb.get_context().call_on_commit(
+                    lambda: seats.scheduleReconcile(conf.key))
+            elif (conf.seatsAvailable or 0) + delta < 0:
+                raise ConflictException(
+                    'maxAttendees is lower than the number of attendees')
+            conf.seatsAvailable = (conf.seatsAvailable or 0) + delta
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cache.invalidate(conf.key)
+        ndb.get_context().call_on_commit(lambda: announcements.update(conf))
+        return self._copyConferenceToForm(conf)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -282,26 +506,31 @@ class ConferenceApi(remote.Service):
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_ETAG_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey), or only
+        notModified when the etag sent is still current."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.get(ndb.Key(urlsafe=request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        etag = self._etag('conference', conf.version)
+        if request.etag == etag:
+            return ConferenceForm(etag=etag, notModified=True)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        form = self._copyConferenceToForm(conf)
+        form.etag = etag
+        return form
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return conferences created by user, one page at a time."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -309,65 +538,37 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        query = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        confs, next_token = self._fetchPage(query, request)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf) for conf in confs],
+            nextPageToken=next_token
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], 
-                filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-
-
-    def _formatFilters(self, filters):
+    def _formatFilters(self, filters, fields=FIELDS):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) \
-                for field in f.all_fields()}
-
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                field = fields[f.field]
+                operator = OPERATORS[f.operator]
             except KeyError:
                 raise endpoints.BadRequestException(
                     "Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
+            value = f.value
+            if field in FIELD_CONVERTERS:
+                try:
+                    value = FIELD_CONVERTERS[field](value)
+                except Exception:
                     raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+                        "Filter contains invalid value for %s." % f.field)
 
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+            formatted_filters.append(Filter(field, operator, value))
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -375,24 +576,16 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) \
-            for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """Query for conferences, one page at a time."""
+        plan = CONFERENCE_PLANNER.plan(self._formatFilters(request.filters))
+        conferences, next_token = self._fetchPlannedPage(
+            CONFERENCE_PLANNER, plan, request)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId]) for conf in conferences]
+                items=[self._copyConferenceToForm(conf) \
+                    for conf in conferences],
+                nextPageToken=next_token
         )
 
 
@@ -400,43 +593,40 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, 
-                        getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_MAPPER(prof)
 
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, 
         creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self, user=None, user_id=None):
+        """Tasklet version of _getProfileFromUser; callers that already
+        resolved the user may pass it and its id."""
         # make sure user is authed
-        user = endpoints.get_current_user()
+        user = user or endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        # get Profile from this request, memcache or datastore
+        user_id = user_id or getUserId(user)
+        profile = yield profiles.getAsync(user_id)
         # create new Profile if not there
         if not profile:
+            p_key = ndb.Key(Profile, user_id)
             profile = Profile(
                 key = p_key,
                 displayName = user.nickname(),
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
+            profiles.invalidate(p_key)
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
 
 
     def _doProfile(self, save_request=None):
@@ -446,19 +636,37 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            prof, oldDisplayName = self._saveProfile(prof.key, save_request)
+
+            # conferences store the organizer name; rewrite them
+            # in the background when it changes
+            if prof.displayName != oldDisplayName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name'
+                )
+
+        # return ProfileForm, listing Registrations and legacy entries
+        form = self._copyProfileToForm(prof)
+        form.conferenceKeysToAttend = self._attending(prof,
+            Registration.query(ancestor=prof.key).fetch(keys_only=True))
+        return form
+
 
-        # return ProfileForm
-        return self._copyProfileToForm(prof)
+    @staticmethod
+    @ndb.transactional()
+    def _saveProfile(profile_key, save_request):
+        """Copy the user-modifyable fields onto the stored Profile;
+        return it and its previous displayName."""
+        prof = profile_key.get()
+        oldDisplayName = prof.displayName
+        for field in ('displayName', 'teeShirtSize'):
+            if hasattr(save_request, field):
+                val = getattr(save_request, field)
+                if val:
+                    setattr(prof, field, str(val))
+        prof.put()
+        profiles.invalidate(profile_key)
+        return prof, oldDisplayName
 
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
@@ -475,118 +683,249 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _updateOrganizerDisplayName(userId, urlsafeCursor=None):
+        """Copy the Profile displayName onto one batch of the organizer's
+        conferences, chaining a task for the next batch if any."""
+        prof = ndb.Key(Profile, userId).get()
+        if not prof:
+            return 0
+
+        cursor = Cursor(urlsafe=urlsafeCursor) if urlsafeCursor else None
+        keys, next_cursor, more = Conference.query(ancestor=prof.key) \
+            .fetch_page(ORGANIZER_UPDATE_BATCH_SIZE, start_cursor=cursor,
+                keys_only=True)
+        changed = sum(1 for key in keys \
+            if ConferenceApi._setOrganizerDisplayName(key, prof.displayName))
+
+        if more and next_cursor:
+            taskqueue.add(params={'userId': userId,
+                'cursor': next_cursor.urlsafe()},
+                url='/tasks/update_organizer_name'
+            )
+        return changed
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _setOrganizerDisplayName(conference_key, displayName):
+        """Set only organizerDisplayName on a freshly read Conference, so
+        concurrent updates and seat reconciles are never reverted."""
+        conf = conference_key.get()
+        if not conf or conf.organizerDisplayName == displayName:
+            return False
+        conf.organizerDisplayName = displayName
+        conf.put()
+        cache.invalidate(conference_key)
+        return True
+
+
+    @staticmethod
+    def _backfillOrganizerDisplayNames(urlsafeCursor=None):
+        """Copy the organizer's displayName onto one batch of conferences
+        stored before they kept it, chaining a task for the next batch."""
+        cursor = Cursor(urlsafe=urlsafeCursor) if urlsafeCursor else None
+        confs, next_cursor, more = Conference.query().fetch_page(
+            ORGANIZER_UPDATE_BATCH_SIZE, start_cursor=cursor)
+
+        missing = [conf for conf in confs if conf.organizerDisplayName is None]
+        organizers = ndb.get_multi([conf.key.parent() for conf in missing])
+        changed = sum(1 for conf, prof in zip(missing, organizers) \
+            if prof and prof.displayName and \
+                ConferenceApi._setOrganizerDisplayName(conf.key,
+                    prof.displayName))
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/backfill_organizer_names'
+            )
+        return changed
+
+
+# - - - Dashboard - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, DashboardForm,
+            path='dashboard', http_method='GET', name='getDashboard')
+    @ndb.synctasklet
+    def getDashboard(self, request):
+        """Return the user's profile, the conferences they attend, the
+        announcement and the featured speaker in one response."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        # the only user id resolution of the request
+        user_id = getUserId(user)
+
+        # profile, registrations, announcement & featured speaker at once
+        prof, registration_keys, announcement, featured = yield (
+            self._getProfileFromUserAsync(user, user_id),
+            Registration.query(ancestor=ndb.Key(Profile, user_id))
+                .fetch_async(keys_only=True),
+            announcements.getAsync(),
+            ndb.get_context().memcache_get(MEMCACHE_FEATURED_SPEAKER))
+        attending = self._attending(prof, registration_keys)
+        conferences = yield [cache.getAsync(ndb.Key(urlsafe=wsck)) \
+            for wsck in attending]
+
+        profile = self._copyProfileToForm(prof)
+        profile.conferenceKeysToAttend = attending
+        raise ndb.Return(DashboardForm(
+            profile=profile,
+            conferencesToAttend=[self._copyConferenceToForm(conf) \
+                for conf in conferences if conf],
+            announcement=announcement or '',
+            featuredSpeaker=featured or '',
+        ))
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Rebuild the nearly sold out Announcement from every Conference
+        & mirror it to memcache; used by the repair cron job.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        return announcements.rebuild()
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(ETAG_REQUEST, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return Announcement from memcache or its durable copy."""
+        return self._stringWithEtag(announcements.get(), request)
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = cache.get(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        conf = seats.ensureShards(conf)
 
         # register
         if reg:
+            if conf.queuedRegistration:
+                raise ConflictException(
+                    "Registration for this conference is queued; "
+                    "use queueForConference")
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            prof = self._getProfileFromUser() # get user Profile
+            user_id = prof.key.id()
+            if wsck in prof.conferenceKeysToAttend or \
+                    registrationKey(user_id, conf.key).get():
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # take a seat from any shard that still has one
+            for shard_key in seats.candidateShards(conf):
+                try:
+                    retval = self._takeSeat(user_id, conf.key, shard_key)
+                    break
+                except seats.ShardExhausted:
+                    continue
+            else:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            retval = self._returnSeat(getUserId(user), conf)
+
+        # a freed seat goes to the waitlist of a queued conference
+        if retval and not reg and conf.queuedRegistration:
+            admission.schedule(conf.key)
+
+        # refresh the reconciled seatsAvailable on the Conference; close
+        # to selling out do it now so the announcement is never behind
+        if retval:
+            if seats.isWatched(conf):
+                seats.reconcile(conf.key)
             else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+                seats.scheduleReconcile(conf.key)
         return BooleanMessage(data=retval)
 
 
+    @staticmethod
+    def _attending(prof, registration_keys):
+        """Return the websafe keys of the conferences prof attends, from
+        its Registrations and the list they replace."""
+        keys = list(prof.conferenceKeysToAttend)
+        keys.extend(key.id() for key in registration_keys
+                    if key.id() not in prof.conferenceKeysToAttend)
+        return keys
+
+
+    @ndb.transactional(xg=True)
+    def _takeSeat(self, user_id, conference_key, shard_key):
+        """Register user, taking one seat from the given shard; only the
+        Registration and the shard are written, never the Profile."""
+        reg_key = registrationKey(user_id, conference_key)
+        prof, registration = ndb.get_multi(
+            [reg_key.parent(), reg_key])
+        if registration or (prof and
+                conference_key.urlsafe() in prof.conferenceKeysToAttend):
+            raise ConflictException(
+                "You have already registered for this conference")
+        shard = seats.takeSeat(shard_key)
+        ndb.put_multi([Registration(key=reg_key,
+            conferenceKey=conference_key), shard])
+        return True
+
+
+    @ndb.transactional(xg=True)
+    def _returnSeat(self, user_id, conf):
+        """Unregister user, giving one seat back to a random shard."""
+        reg_key = registrationKey(user_id, conf.key)
+        prof, registration = ndb.get_multi(
+            [reg_key.parent(), reg_key])
+        wsck = conf.key.urlsafe()
+        if registration:
+            reg_key.delete()
+        elif prof and wsck in prof.conferenceKeysToAttend:
+            # registered before Registrations existed
+            prof.conferenceKeysToAttend.remove(wsck)
+            prof.put()
+            profiles.invalidate(prof.key)
+        else:
+            return False
+        seats.returnSeat(conf).put()
+        return True
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @ndb.synctasklet
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) \
-            for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) \
-            for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        # get user Profile and Registrations at once
+        prof, registration_keys = yield (
+            self._getProfileFromUserAsync(),
+            Registration.query(ancestor=ndb.Key(Profile, getUserId(user)))
+                .fetch_async(keys_only=True))
+        # the cache lookups run together: one memcache and one datastore
+        # batch for whatever the local cache misses
+        conferences = yield [cache.getAsync(ndb.Key(urlsafe=wsck)) \
+            for wsck in self._attending(prof, registration_keys)]
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, names[conf.organizerUserId]) for conf in conferences]
-        )
+        raise ndb.Return(ConferenceForms(
+            items=[self._copyConferenceToForm(conf) \
+                for conf in conferences if conf]
+        ))
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -605,6 +944,117 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
+    @endpoints.method(CONF_GET_REQUEST, TicketForm,
+            path='conference/{websafeConferenceKey}/queue',
+            http_method='POST', name='queueForConference')
+    def queueForConference(self, request):
+        """Queue a registration for a conference taking queued
+        registrations; return the ticket to poll."""
+        prof = self._getProfileFromUser() # get user Profile
+        wsck = request.websafeConferenceKey
+        conf = cache.get(ndb.Key(urlsafe=wsck))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if not conf.queuedRegistration:
+            raise endpoints.BadRequestException(
+                "This conference does not queue registrations; "
+                "use registerForConference")
+        if wsck in prof.conferenceKeysToAttend or \
+                registrationKey(prof.key.id(), conf.key).get():
+            raise ConflictException(
+                "You have already registered for this conference")
+        ticket, status = admission.enqueue(conf.key, prof.key.id())
+        return TicketForm(ticket=ticket,
+            status=TicketStatus.lookup_by_name(status))
+
+
+    @endpoints.method(TICKET_GET_REQUEST, TicketForm,
+            path='conference/{websafeConferenceKey}/ticket/{ticket}',
+            http_method='GET', name='getRegistrationTicket')
+    def getRegistrationTicket(self, request):
+        """Return the status of the user's queued registration ticket."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        status, position = admission.ticketStatus(
+            ndb.Key(urlsafe=request.websafeConferenceKey), getUserId(user),
+            request.ticket)
+        if not status:
+            raise endpoints.NotFoundException(
+                'No ticket found: %s' % request.ticket)
+        return TicketForm(ticket=request.ticket,
+            status=TicketStatus.lookup_by_name(status),
+            waitlistPosition=position)
+
+
+    @endpoints.method(CONF_ATTENDEES_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return the attendees of a conference, one page at a time, and
+        their count; only for the organizer.  Only Registration entities
+        are listed, while the count also includes registrations still
+        held in Profile.conferenceKeysToAttend, so the list is incomplete
+        until /admin/migrate_registrations has run."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf = cache.get(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the organizer can list the attendees.')
+
+        query = Registration.query(Registration.conferenceKey == conf.key)
+        registrations, next_token = self._fetchPage(query, request)
+        attendees = ndb.get_multi([reg.key.parent() for reg in registrations])
+        items = []
+        for reg, prof in zip(registrations, attendees):
+            if prof:
+                form = ATTENDEE_MAPPER(prof)
+                form.registered = str(reg.created)
+                items.append(form)
+        return AttendeeForms(items=items, nextPageToken=next_token,
+            attendees=seats.attendeeCount(conf))
+
+
+    @staticmethod
+    def _migrateRegistrations(urlsafeCursor=None):
+        """Move one batch of Profiles' conferenceKeysToAttend lists into
+        Registrations, chaining a task for the next batch if any."""
+        cursor = Cursor(urlsafe=urlsafeCursor) if urlsafeCursor else None
+        keys, next_cursor, more = Profile.query().fetch_page(
+            REGISTRATION_MIGRATION_BATCH_SIZE, start_cursor=cursor,
+            keys_only=True)
+
+        @ndb.transactional()
+        def _migrate(p_key):
+            # seats were taken when the list entries were added, so the
+            # shard counts already include them
+            prof = p_key.get()
+            if not prof or not prof.conferenceKeysToAttend:
+                return False
+            ndb.put_multi([Registration(
+                key=registrationKey(p_key.id(),
+                    ndb.Key(urlsafe=wsck)),
+                conferenceKey=ndb.Key(urlsafe=wsck))
+                for wsck in prof.conferenceKeysToAttend])
+            prof.conferenceKeysToAttend = []
+            prof.put()
+            profiles.invalidate(p_key)
+            return True
+
+        migrated = sum(1 for p_key in keys if _migrate(p_key))
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_registrations'
+            )
+        return migrated
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
@@ -621,51 +1071,23 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month==6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=[self._copyConferenceToForm(conf) for conf in q]
         )
 
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        # copy relevant fields from Session to SessionForm
-        form = SessionForm()
-        setattr(form, 'websafeKey', session.key.urlsafe())
-        for field in form.all_fields():
-            if hasattr(session, field.name):
-                # convert session type enum to string; just copy others
-                if field.name == 'typeOfSession':
-                    if getattr(session, field.name) == '' or getattr(session, field.name) is None:
-                        setattr(form, field.name, 'Other')
-                    else:
-                        setattr(form, field.name, getattr(SessionType, 
-                            getattr(session, field.name)))
-                elif field.name == 'conferenceKey' or field.name == 'speakerKey':
-                    value = getattr(session, field.name)
-                    if value is not None:
-                        setattr(form, field.name, 
-                            getattr(session, field.name).urlsafe())
-                    else:
-                        setattr(form, field.name, '')
-                elif field.name == 'startTime' or field.name == 'date':
-                    setattr(form, field.name, 
-                        str(getattr(session, field.name)))
-                else:
-                    setattr(form, field.name, 
-                        getattr(session, field.name))
-        form.check_initialized()
-        return form
+        return SESSION_MAPPER(session)
 
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(CONF_PAGE_REQUEST, SessionForms,
             path='getConferenceSessions',
             http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Get Conference Sessions"""
-        query = Session.query(ancestor=ndb.Key(
-            urlsafe=request.websafeConferenceKey))
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in query]
-        )
+        conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        query = Session.query(ancestor=conference_key)
+        return self._getScheduleForms(conference_key, query, request)
 
     @endpoints.method(CONF_TYPE_GET_REQUEST, SessionForms,  
             path='getConferenceSessionsByType',
@@ -675,31 +1097,60 @@ class ConferenceApi(remote.Service):
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         query = Session.query(ancestor=conference_key) \
                 .filter(Session.typeOfSession == str(request.typeOfSession))
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in query]
-        )
+        return self._getScheduleForms(conference_key, query, request,
+            str(request.typeOfSession))
 
-    @endpoints.method(SPEAKER_REQUEST, SessionForms,
+
+    def _getScheduleForms(self, conference_key, query, request, typeName=''):
+        """Return one page of a conference schedule as SessionForms,
+        served from memcache until the conference's sessions change, or
+        only notModified when the etag sent is still current."""
+        conf = cache.get(conference_key)
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        etag = self._etag('sessions', conf.sessionsVersion, typeName,
+            request.pageSize, request.pageToken)
+        if request.etag == etag:
+            return SessionForms(etag=etag, notModified=True)
+
+        wsck = conference_key.urlsafe()
+        # page tokens are long; hash the page parameters into the key
+        page = hashlib.md5('%s|%s|%s' % (typeName, request.pageSize,
+            request.pageToken)).hexdigest()
+        name = MEMCACHE_SESSIONS_KEY % (wsck, page)
+        payload, version = cache.getVersioned(SESSIONS_NAMESPACE % wsck, name)
+        if payload is not None:
+            forms = protojson.decode_message(SessionForms, payload)
+        else:
+            sessions, next_token = self._fetchPage(query, request)
+            forms = SessionForms(
+                items=[self._copySessionToForm(session) \
+                    for session in sessions],
+                nextPageToken=next_token
+            )
+            cache.setVersioned(name, version, protojson.encode_message(forms))
+        forms.etag = etag
+        return forms
+
+    @endpoints.method(SPEAKER_PAGE_REQUEST, SessionForms,
             path='getSessionsBySpeaker',
             http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Get all sessions for a speaker"""
         speaker_key = ndb.Key(urlsafe=request.websafeSpeakerKey)
         query = Session.query().filter(Session.speakerKey == speaker_key)
+        sessions, next_token = self._fetchPage(query, request)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in query]
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token
         )
 
     def _copySpeakerToForm(self, speaker):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        form = SpeakerForm()
-        if speaker is not None:
-            setattr(form, 'websafeKey', speaker.key.urlsafe())
-            for field in form.all_fields():
-                if hasattr(speaker, field.name):
-                    setattr(form, field.name, getattr(speaker, field.name))
-            form.check_initialized()
-        return form
+        if speaker is None:
+            return SpeakerForm()
+        return SPEAKER_MAPPER(speaker)
 
     def _createSpeakerObject(self, request):
         """Create Speaker object, 
@@ -739,14 +1190,16 @@ class ConferenceApi(remote.Service):
         return self._createSpeakerObject(request)
 
 
-    @endpoints.method(StringMessage, SpeakerForms,
+    @endpoints.method(SPEAKER_NAME_REQUEST, SpeakerForms,
             path='getSpeakersByName',
             http_method='GET', name='getSpeakersByName')
     def getSpeakersByName(self, request):
         """Get a list of speakers with the given name"""
         query = Speaker.query().filter(Speaker.name == request.data)
+        speakers, next_token = self._fetchPage(query, request)
         return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker) for speaker in query]
+            items=[self._copySpeakerToForm(speaker) for speaker in speakers],
+            nextPageToken=next_token
         )
 
 
@@ -755,28 +1208,26 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getSpeakerForSession')
     def getSpeakerForSession(self, request):
         """Get speaker for a session"""
-        speaker_key = ndb.Key(urlsafe=request.websafeSessionKey) \
-            .get().speakerKey.get()
-        return self._copySpeakerToForm(speaker_key)
+        session = cache.get(ndb.Key(urlsafe=request.websafeSessionKey))
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
+        speaker = cache.get(session.speakerKey) if session.speakerKey else None
+        return self._copySpeakerToForm(speaker)
 
 
     @staticmethod
     def _featureSpeaker(urlsafeSpeakerKey, urlsafeConferenceKey):
         """Feature speaker with more than one session at conference"""
-        conference_key = ndb.Key(urlsafe=urlsafeConferenceKey)
-        conference_name = conference_key.get().name
-        speaker_key = ndb.Key(urlsafe=urlsafeSpeakerKey)
-        speaker_name = speaker_key.get().name
-        sessions = Session.query(ancestor=conference_key) \
-            .filter(Session.speakerKey == speaker_key)
-
-        if sessions.count() > 1:
+        counter = ndb.Key(SpeakerSessions, urlsafeSpeakerKey,
+            parent=ndb.Key(urlsafe=urlsafeConferenceKey)).get()
+
+        if counter and len(counter.sessionKeys) > 1:
             # If there are multiple sessions for the speaker at the conference,
             # add the featured speaker to the memcache
-            memcache.delete(MEMCACHE_FEATURED_SPEAKER)
             announcement = 'Now at %s, attend these sessions from speaker %s: %s' \
-                 % (conference_name, speaker_name,
-                ', '.join(session.name for session in sessions))
+                 % (counter.conferenceName, counter.speakerName,
+                ', '.join(counter.sessionNames))
             memcache.set(MEMCACHE_FEATURED_SPEAKER, announcement)
         else:
             announcement = ''
@@ -784,15 +1235,108 @@ class ConferenceApi(remote.Service):
         return announcement
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @staticmethod
+    @ndb.tasklet
+    def _scheduleFeatureSpeaker(speaker_key, conference_key):
+        """Enqueue the featured speaker check for a (conference, speaker)
+        pair; requests within the same window share one task.  Returns a
+        future, so callers can overlap the enqueue with other work."""
+        window = int(clock.time() // FEATURE_SPEAKER_WINDOW)
+        try:
+            yield taskqueue.Queue().add_async(taskqueue.Task(
+                params={'urlsafeSpeakerKey': speaker_key.urlsafe(),
+                    'urlsafeConferenceKey': conference_key.urlsafe()},
+                url='/tasks/feature_speaker',
+                name='feature-%s-%s-%d' % (conference_key.urlsafe(),
+                    speaker_key.urlsafe(), window),
+                countdown=FEATURE_SPEAKER_WINDOW
+            ))
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _speakerSessionsKey(speaker_key, conference_key):
+        return ndb.Key(SpeakerSessions, speaker_key.urlsafe(),
+            parent=conference_key)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _putSessionsAndCounts(sessions, conference_name, speaker_names,
+                              seed=True):
+        """Store new sessions of one conference and add them to their
+        speakers' counters; all live in the Conference entity group.
+        speaker_names maps speaker keys to names.  Counters missing are
+        seeded from the sessions already stored unless seed is False."""
+        conference_key = sessions[0].conferenceKey
+        speaker_keys = list(set(session.speakerKey for session in sessions))
+        counter_keys = [ConferenceApi._speakerSessionsKey(
+            speaker_key, conference_key) for speaker_key in speaker_keys]
+        counters = {}
+        for speaker_key, counter_key, counter in zip(speaker_keys,
+                counter_keys, ndb.get_multi(counter_keys)):
+            if counter is None:
+                existing = []
+                if seed:
+                    # start from sessions stored before counters existed
+                    existing = Session.query(ancestor=conference_key) \
+                        .filter(Session.speakerKey == speaker_key).fetch()
+                counter = SpeakerSessions(key=counter_key,
+                    sessionKeys=[s.key for s in existing],
+                    sessionNames=[s.name for s in existing])
+            counter.conferenceName = conference_name
+            counter.speakerName = speaker_names[speaker_key]
+            counters[speaker_key] = counter
+
+        for session in sessions:
+            counter = counters[session.speakerKey]
+            # a retried import batch stores the same sessions again
+            if session.key not in counter.sessionKeys:
+                counter.sessionKeys.append(session.key)
+                counter.sessionNames.append(session.name)
+        conf = ConferenceApi._stampSessionsVersion(conference_key)
+        ndb.put_multi(sessions + counters.values() + [conf])
+
+
+    @staticmethod
+    def _stampSessionsVersion(conference_key):
+        """Return the conference with a new sessionsVersion, to be put
+        in the transaction that changes its sessions."""
+        conf = conference_key.get()
+        conf.sessionsVersion = nextVersion(conf.sessionsVersion)
+        cache.invalidate(conference_key)
+        return conf
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _deleteSessionAndCount(session):
+        """Delete a session and remove it from its speaker's counter."""
+        session.key.delete()
+        ConferenceApi._stampSessionsVersion(session.conferenceKey).put()
+        if not session.speakerKey:
+            return
+        counter = ConferenceApi._speakerSessionsKey(
+            session.speakerKey, session.conferenceKey).get()
+        if counter and session.key in counter.sessionKeys:
+            index = counter.sessionKeys.index(session.key)
+            del counter.sessionKeys[index]
+            del counter.sessionNames[index]
+            counter.put()
+
+
+    @endpoints.method(ETAG_REQUEST, StringMessage,
             path='conference/featured_speaker/get',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Return Featured Speaker from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_FEATURED_SPEAKER) or "")
+        return self._stringWithEtag(
+            memcache.get(MEMCACHE_FEATURED_SPEAKER) or "", request)
 
 
+    @ndb.synctasklet
     def _createSessionObject(self, request):
         """Create or update Session object, 
         returning SessionForm/request."""
@@ -819,10 +1363,20 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No speaker found with key: %s' % request.websafeSpeakerKey)
 
+        # load conference and speaker and allocate the session ID at once
         userId = getUserId(user)
-        if userId != conference_key.get().organizerUserId:
+        session_ids, conf, speaker = yield (
+            Session.allocate_ids_async(size=1, parent=conference_key),
+            cache.getAsync(conference_key), cache.getAsync(speaker_key))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if userId != conf.organizerUserId:
             raise ConflictException(
                 'Only the conference organizer can make sessions for the conference')
+        if not speaker:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.websafeSpeakerKey)
 
         # copy SessionForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) \
@@ -850,23 +1404,22 @@ class ConferenceApi(remote.Service):
             data['typeOfSession'] = data['typeOfSession'].name
 
 
-        session_id = Session.allocate_ids(size=1, parent=conference_key)[0]
-        session_key = ndb.Key(Session, session_id, parent=conference_key)
+        session_key = ndb.Key(Session, session_ids[0], parent=conference_key)
         data['key'] = session_key
 
         data['conferenceKey'] = conference_key
         data['speakerKey'] = speaker_key
 
-        # create Session, send email to organizer confirming
-        # creation of Session & return (modified) SessionForm
+        # create Session together with its speaker counter, check the
+        # featured speaker & return (modified) SessionForm
         session = Session(**data)
-        session.put()
-
-        taskqueue.add(params={'urlsafeSpeakerKey': request.websafeSpeakerKey,
-            'urlsafeConferenceKey': request.websafeConferenceKey},
-            url='/tasks/feature_speaker'
-        )
-        return self._copySessionToForm(session)
+        self._putSessionsAndCounts([session], conf.name,
+            {speaker_key: speaker.name})
+        scheduled = self._scheduleFeatureSpeaker(speaker_key, conference_key)
+        cache.invalidate(session_key)
+        cache.bumpVersion(SESSIONS_NAMESPACE % conference_key.urlsafe())
+        yield scheduled
+        raise ndb.Return(self._copySessionToForm(session))
 
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
@@ -896,96 +1449,249 @@ class ConferenceApi(remote.Service):
                 'No session found with key: %s' % request.websafeSessionKey)
 
         # Check that user matches conference organizer
-        conference_key = session_key.get().conferenceKey
-        if user_id != conference_key.get().organizerUserId:
+        session = session_key.get()
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
+        conference_key = session.conferenceKey
+        if user_id != cache.get(conference_key).organizerUserId:
             raise ConflictException(
                 'Only the conference organizer can delete sessions for the conference')
 
-        session_key.delete()
-
-        # Delete session_key from profile wishlists
-        profiles = Profile.query()
-        for profile in profiles:
-            if session_key in profile.sessionWishlist:
-                profile.sessionWishlist.remove(session_key)
-                profile.put()
+        self._deleteSessionAndCount(session)
+        # Delete session_key from profile wishlists in the background;
+        # both tasks are enqueued while the caches are invalidated
+        enqueued = [taskqueue.Queue().add_async(taskqueue.Task(
+            params={'websafeSessionKey': session_key.urlsafe()},
+            url='/tasks/clean_wishlists'
+        ))]
+        if session.speakerKey:
+            enqueued.append(self._scheduleFeatureSpeaker(
+                session.speakerKey, conference_key))
+        cache.invalidate(session_key)
+        cache.bumpVersion(SESSIONS_NAMESPACE % conference_key.urlsafe())
+        for rpc in enqueued:
+            rpc.get_result()
         return StringMessage(data='Session deleted')
 
 
+    @staticmethod
+    def _removeSessionFromWishlists(websafeSessionKey, urlsafeCursor=None):
+        """Remove a deleted session from one batch of the wishlists that
+        reference it, chaining a task for the next batch if any."""
+        session_key = ndb.Key(urlsafe=websafeSessionKey)
+        cursor = Cursor(urlsafe=urlsafeCursor) if urlsafeCursor else None
+        # sessionWishlist is indexed, so only referencing profiles are read
+        wishers, next_cursor, more = Profile.query(
+            Profile.sessionWishlist == session_key).fetch_page(
+            WISHLIST_CLEANUP_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # each profile is re-read and written in its own transaction so
+        # concurrent profile changes are never overwritten
+        for profile_key in wishers:
+            ConferenceApi._pruneWishlist(profile_key, [session_key])
+
+        if more and next_cursor:
+            taskqueue.add(params={'websafeSessionKey': websafeSessionKey,
+                'cursor': next_cursor.urlsafe()},
+                url='/tasks/clean_wishlists'
+            )
+        return len(wishers)
+
+
     @endpoints.method(WISHLIST_POST_REQUEST, StringMessage,
             path='profile/wishlist',
             http_method='POST', name='addSessionToWishlist')
     def addSessionToWishlist(self, request):
         """Add a session to the current user's wishlist"""
-        # Get current user
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        profile = ndb.Key(Profile, user_id).get()
+        profile = self._getProfileFromUser()
         session_key = ndb.Key(urlsafe=request.websafeSessionKey)
-        if session_key not in profile.sessionWishlist:
-            profile.sessionWishlist.append(session_key)
-            profile.put()
-        else:
+        # the cached Profile is only read; the write re-reads it
+        if not self._addToWishlist(profile.key, session_key):
             raise endpoints.BadRequestException(
                 'Session to add already exists in the user\'s wishlist')
         return StringMessage(data='Session added to wishlist')
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
             path='profile/wishlist',
             http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishList(self, request):
-        """Get all sessions in the user's wishlist"""
-        # Get current user
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        profile = ndb.Key(Profile, user_id).get()
+        """Get all sessions in the user's wishlist, optionally sorted
+        by date and start time"""
+        profile = self._getProfileFromUser()
+        # resolve the whole wishlist in one batch get
         session_keys = profile.sessionWishlist
+        sessions = ndb.get_multi(session_keys)
+
+        # drop sessions that no longer exist from the wishlist
+        missing = [key for key, session in zip(session_keys, sessions) \
+            if session is None]
+        if missing:
+            self._pruneWishlist(profile.key, missing)
+        sessions = [session for session in sessions if session is not None]
+
+        if request.sortByDate:
+            # undated sessions go last; py2 cannot compare dates with None
+            sessions.sort(key=lambda session: (
+                session.date is None, session.date,
+                session.startTime is None, session.startTime))
         return SessionForms(
-            items=[self._copySessionToForm(session_key.get()) \
-                for session_key in session_keys]
+            items=[self._copySessionToForm(session) for session in sessions]
         )
 
+
+    @staticmethod
+    @ndb.transactional()
+    def _pruneWishlist(profile_key, session_keys):
+        """Remove the given session keys from a Profile's wishlist;
+        return whether any was there."""
+        profile = profile_key.get()
+        if not profile:
+            return False
+        wishlist = [key for key in profile.sessionWishlist \
+            if key not in session_keys]
+        if len(wishlist) == len(profile.sessionWishlist):
+            return False
+        profile.sessionWishlist = wishlist
+        profile.put()
+        profiles.invalidate(profile_key)
+        return True
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _addToWishlist(profile_key, session_key):
+        """Append a session key to a Profile's wishlist; return whether
+        it was missing."""
+        profile = profile_key.get()
+        if session_key in profile.sessionWishlist:
+            return False
+        profile.sessionWishlist.append(session_key)
+        profile.put()
+        profiles.invalidate(profile_key)
+        return True
+
     @endpoints.method(WISHLIST_POST_REQUEST, StringMessage,
             path='profile/wishlist',
             http_method='DELETE', name='deleteSessionInWishlist')
     def deleteSessionInWishlist(self, request):
         """Delete a session in the user's wishlist"""
-        # Get current user
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        profile = ndb.Key(Profile, user_id).get()
+        profile = self._getProfileFromUser()
         session_key = ndb.Key(urlsafe=request.websafeSessionKey)
-        if session_key in profile.sessionWishlist:
-            profile.sessionWishlist.remove(session_key)
-            profile.put()
-        else:
+        if not self._pruneWishlist(profile.key, [session_key]):
             raise endpoints.BadRequestException(
                 'Session to delete does not exist in the user\'s wishlist')
         return StringMessage(data='Session deleted from wishlist')
 
+    @staticmethod
+    def _uniqueSessionKeys(websafeSessionKeys):
+        """Return the Session keys named by the request, without repeats
+        and in order."""
+        if len(websafeSessionKeys) > MAX_WISHLIST_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d session keys per request' % MAX_WISHLIST_BATCH)
+        keys, seen = [], set()
+        for wssk in websafeSessionKeys:
+            try:
+                key = ndb.Key(urlsafe=wssk)
+            except (TypeError, ProtocolBufferDecodeError):
+                raise endpoints.BadRequestException(
+                    'Malformed session key: %s' % wssk)
+            if key.kind() != 'Session':
+                raise endpoints.BadRequestException(
+                    'Not a session key: %s' % wssk)
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+        return keys
+
+
+    @ndb.transactional()
+    def _applyWishlist(self, profile_key, session_keys, mode, missing):
+        """Add, remove or replace session keys in a Profile's wishlist
+        with one write, dropping sessions known to be gone; return the
+        resulting wishlist."""
+        profile = profile_key.get()
+        if mode == 'replace':
+            wishlist = list(session_keys)
+        elif mode == 'remove':
+            removed = set(session_keys)
+            wishlist = [key for key in profile.sessionWishlist \
+                if key not in removed]
+        else:
+            listed = set(profile.sessionWishlist)
+            wishlist = profile.sessionWishlist + [key for key in session_keys \
+                if key not in listed]
+        wishlist = [key for key in wishlist if key not in missing]
+        if wishlist != profile.sessionWishlist:
+            profile.sessionWishlist = wishlist
+            profile.put()
+            profiles.invalidate(profile_key)
+        return wishlist
+
+
+    def _changeWishlist(self, request, mode):
+        """Apply a batch wishlist change; return the resulting wishlist."""
+        profile = self._getProfileFromUser()
+        session_keys = self._uniqueSessionKeys(request.websafeSessionKeys)
+        requested = set(session_keys)
+
+        # one batch get verifies the sessions and, unless the wishlist
+        # changes meanwhile, holds every session of the result
+        keys = [key for key in profile.sessionWishlist \
+            if key not in requested]
+        if mode == 'replace':
+            keys = session_keys
+        elif mode == 'add':
+            keys = session_keys + keys
+        found = dict(zip(keys, ndb.get_multi(keys)))
+        missing = set(key for key, session in found.items() if not session)
+        if mode != 'remove':
+            unknown = [key.urlsafe() for key in session_keys \
+                if key in missing]
+            if unknown:
+                raise endpoints.NotFoundException(
+                    'No session found with key: %s' % ', '.join(unknown))
+
+        wishlist = self._applyWishlist(profile.key, session_keys, mode,
+            missing)
+        unseen = [key for key in wishlist if key not in found]
+        found.update(zip(unseen, ndb.get_multi(unseen)))
+        return SessionForms(items=[self._copySessionToForm(found[key]) \
+            for key in wishlist if found[key]])
+
+
+    @endpoints.method(WishlistForm, SessionForms,
+            path='profile/wishlist/add',
+            http_method='POST', name='addSessionsToWishlist')
+    def addSessionsToWishlist(self, request):
+        """Add sessions to the current user's wishlist; return it"""
+        return self._changeWishlist(request, 'add')
+
+
+    @endpoints.method(WishlistForm, SessionForms,
+            path='profile/wishlist/remove',
+            http_method='POST', name='removeSessionsFromWishlist')
+    def removeSessionsFromWishlist(self, request):
+        """Remove sessions from the current user's wishlist; return it"""
+        return self._changeWishlist(request, 'remove')
+
+
+    @endpoints.method(WishlistForm, SessionForms,
+            path='profile/wishlist',
+            http_method='PUT', name='replaceWishlist')
+    def replaceWishlist(self, request):
+        """Replace the current user's wishlist; return it"""
+        return self._changeWishlist(request, 'replace')
+
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='deleteAllSessionsInWishlist',
             http_method='DELETE', name='deleteAllSessionsInWishlist')
     def deleteAllSessionsInWishlist(self, request):
         """Delete all sessions from the current user's wishlist"""
-        # Get current user
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        profile = ndb.Key(Profile, user_id).get()
-        profile.sessionWishlist = []
-        profile.put()
+        profile = self._getProfileFromUser()
+        self._applyWishlist(profile.key, [], 'replace', set())
         return StringMessage(data='All sessions deleted from wishlist')
 
     @endpoints.method(SPEAKER_REQUEST, SessionForms,
@@ -1007,15 +1713,251 @@ class ConferenceApi(remote.Service):
     def nonWorkshopSessionsBefore7(self, request):
         """Return all sessions that are not workshops
         and start before 7pm (19:00)"""
-        nonWorkshop = Session.query(Session.typeOfSession != 'Workshop') \
-            .fetch(keys_only=True)
-        before7 = Session.query(Session.startTime <= \
-            datetime.strptime('19:00', '%H:%M').time()).fetch(keys_only=True)
-        sessions = ndb.get_multi(set(nonWorkshop).intersection(before7))
+        plan = SESSION_PLANNER.plan([
+            Filter('typeOfSession', '!=', 'Workshop'),
+            Filter('startTime', '<=', time(19, 0)),
+        ])
+        return SessionForms(
+            items=[self._copySessionToForm(session) \
+                for session in SESSION_PLANNER.run(plan)]
+        )
 
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+            path='querySessions',
+            http_method='POST', name='querySessions')
+    def querySessions(self, request):
+        """Query for sessions with any combination of filters,
+        optionally within one conference."""
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+        plan = SESSION_PLANNER.plan(
+            self._formatFilters(request.filters, SESSION_FIELDS), ancestor)
+        sessions, next_token = self._fetchPlannedPage(
+            SESSION_PLANNER, plan, request)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token
         )
 
 
+# - - - Bulk import - - - - - - - - - - - - - - - - - - - - -
+
+    def _copyImportToForm(self, job):
+        """Copy relevant fields from ImportJob to ImportStatusForm."""
+        return ImportStatusForm(
+            websafeKey=job.key.urlsafe(),
+            status=job.status,
+            total=job.total,
+            processed=job.processed,
+            websafeConferenceKey=job.conferenceKey.urlsafe()
+        )
+
+
+    @endpoints.method(ImportForm, ImportStatusForm,
+            path='import',
+            http_method='POST', name='importConference')
+    def importConference(self, request):
+        """Import a conference with its speakers and sessions, or more
+        sessions for an existing conference, from JSON lines or CSV."""
+        prof = self._getProfileFromUser()
+        user_id = prof.key.id()
+
+        conf_key = None
+        if request.websafeConferenceKey:
+            conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            conf = cache.get(conf_key)
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            if user_id != conf.organizerUserId:
+                raise ConflictException(
+                    'Only the conference organizer can import into the conference')
+
+        try:
+            records = importer.parse(request.data, request.format,
+                hasConference=conf_key is not None)
+        except importer.InvalidImport as e:
+            raise endpoints.BadRequestException('Invalid import: %s' % e)
+
+        # speakers referenced by key must exist
+        speaker_keys = list(set(ndb.Key(urlsafe=record['websafeSpeakerKey'])
+            for record in records if record['kind'] == 'session' \
+                and record['websafeSpeakerKey']))
+        missing = [key.urlsafe() for key, speaker in zip(speaker_keys,
+            ndb.get_multi(speaker_keys)) if not isinstance(speaker, Speaker)]
+        if missing:
+            raise endpoints.BadRequestException(
+                'No speaker found with key: %s' % ', '.join(missing))
+
+        # allocate all ids up front, in one block per kind, and keep them
+        # on the job so a retried batch writes the same entities again
+        new_conference = conf_key is None
+        if new_conference:
+            c_id = Conference.allocate_ids(size=1, parent=prof.key)[0]
+            conf_key = ndb.Key(Conference, c_id, parent=prof.key)
+            records[0]['id'] = c_id
+        speakers = [r for r in records if r['kind'] == 'speaker']
+        sessions = [r for r in records if r['kind'] == 'session']
+        if speakers:
+            speaker_ids = Speaker.allocate_ids_async(size=len(speakers))
+        if sessions:
+            session_ids = Session.allocate_ids_async(size=len(sessions),
+                parent=conf_key)
+
+        refs = {}
+        if speakers:
+            first = speaker_ids.get_result()[0]
+            for i, record in enumerate(speakers):
+                record['id'] = first + i
+                refs[record['ref']] = ndb.Key(Speaker, first + i).urlsafe()
+        if sessions:
+            first = session_ids.get_result()[0]
+            for i, record in enumerate(sessions):
+                record['id'] = first + i
+                if record['speakerRef']:
+                    record['websafeSpeakerKey'] = refs[record['speakerRef']]
+
+        try:
+            importer.checkSize(records)
+        except importer.InvalidImport as e:
+            raise endpoints.BadRequestException('Invalid import: %s' % e)
+
+        job = ImportJob(organizerUserId=user_id, conferenceKey=conf_key,
+            newConference=new_conference, records=records,
+            total=len(records))
+        job.put()
+        self._scheduleImportBatch(job)
+        return self._copyImportToForm(job)
+
+
+    @endpoints.method(IMPORT_GET_REQUEST, ImportStatusForm,
+            path='import/{websafeImportKey}',
+            http_method='GET', name='getImportStatus')
+    def getImportStatus(self, request):
+        """Return the progress of an import."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        job = ndb.Key(urlsafe=request.websafeImportKey).get()
+        if not isinstance(job, ImportJob) \
+                or job.organizerUserId != getUserId(user):
+            raise endpoints.NotFoundException(
+                'No import found with key: %s' % request.websafeImportKey)
+        return self._copyImportToForm(job)
+
+
+    @staticmethod
+    def _scheduleImportBatch(job):
+        """Enqueue the next batch of an import; the task is named after
+        its position so a retried batch cannot start the chain twice."""
+        try:
+            taskqueue.add(params={'websafeImportKey': job.key.urlsafe()},
+                url='/tasks/import_batch',
+                name='import-%d-%d' % (job.key.id(), job.processed)
+            )
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _importedEntity(record, job):
+        """Build the entity for a normalized import record."""
+        data = dict((name, value) for name, value in record.items() \
+            if name not in ('kind', 'id', 'ref', 'speakerRef',
+                            'websafeSpeakerKey'))
+        defaults = DEFAULTS if record['kind'] == 'conference' \
+            else SESSION_DEFAULTS if record['kind'] == 'session' else {}
+        for default in defaults:
+            if default in data and data[default] in (None, []):
+                data[default] = defaults[default]
+
+        if record['kind'] == 'speaker':
+            return Speaker(key=ndb.Key(Speaker, record['id']), **data)
+
+        if record['kind'] == 'conference':
+            for name in ('startDate', 'endDate'):
+                if data[name]:
+                    data[name] = datetime.strptime(
+                        data[name], "%Y-%m-%d").date()
+            data['month'] = data['startDate'].month if data['startDate'] else 0
+            data['seatsAvailable'] = data['maxAttendees']
+            prof = profiles.get(job.organizerUserId)
+            return Conference(key=job.conferenceKey,
+                organizerUserId=job.organizerUserId,
+                organizerDisplayName=prof.displayName if prof else None,
+                **data)
+
+        data['startTime'] = datetime.strptime(
+            data['startTime'], "%H:%M").time()
+        if data['date']:
+            data['date'] = datetime.strptime(data['date'], "%Y-%m-%d").date()
+        return Session(
+            key=ndb.Key(Session, record['id'], parent=job.conferenceKey),
+            conferenceKey=job.conferenceKey,
+            speakerKey=ndb.Key(urlsafe=record['websafeSpeakerKey']),
+            **data)
+
+
+    @staticmethod
+    def _importBatch(websafeImportKey):
+        """Store the next batch of an import and chain the batch after
+        it; every step rewrites the same keys, so a failed batch is simply
+        retried by the task queue."""
+        job = ndb.Key(urlsafe=websafeImportKey).get()
+        if not job or job.status == 'done':
+            return 0
+
+        batch = [ConferenceApi._importedEntity(record, job) for record \
+            in job.records[job.processed:job.processed + IMPORT_BATCH_SIZE]]
+        conferences = [e for e in batch if isinstance(e, Conference)]
+        speakers = [e for e in batch if isinstance(e, Speaker)]
+        sessions = [e for e in batch if isinstance(e, Session)]
+
+        # conferences are visible once stored; never reset their seats
+        if conferences and not job.conferenceKey.get():
+            seats.putWithShards(conferences[0])
+        ndb.put_multi(speakers)
+        if sessions:
+            conf = job.conferenceKey.get()
+            speaker_keys = list(set(s.speakerKey for s in sessions))
+            speaker_names = dict((speaker.key, speaker.name) for speaker \
+                in ndb.get_multi(speaker_keys))
+            ConferenceApi._putSessionsAndCounts(sessions, conf.name,
+                speaker_names, seed=not job.newConference)
+            cache.bumpVersion(SESSIONS_NAMESPACE % job.conferenceKey.urlsafe())
+
+            # one featured speaker check per batch, for its busiest speaker
+            busiest = max(speaker_keys, key=lambda speaker_key: sum(
+                1 for s in sessions if s.speakerKey == speaker_key))
+            ConferenceApi._scheduleFeatureSpeaker(
+                busiest, job.conferenceKey).get_result()
+
+        job.processed += len(batch)
+        job.status = 'done' if job.processed >= job.total else 'running'
+        job.put()
+        if job.status == 'running':
+            ConferenceApi._scheduleImportBatch(job)
+        else:
+            ConferenceApi._importFinished(job)
+        return len(batch)
+
+
+    @staticmethod
+    def _importFinished(job):
+        """Send the organizer one email for the whole import."""
+        prof = profiles.get(job.organizerUserId)
+        if not prof or not prof.mainEmail:
+            return
+        counts = collections.Counter(record['kind'] \
+            for record in job.records)
+        mailer.send('importFinished', prof.mainEmail,
+            displayName=prof.displayName or prof.mainEmail,
+            name=job.conferenceKey.get().name,
+            speakers=counts['speaker'], sessions=counts['session'])
+
+
 api = endpoints.api_server([ConferenceApi]) # register API
+api = profiler.middleware(metrics.middleware(api))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""
+importer.py -- parsing and validation of bulk conference imports
+
+An import describes one event as JSON lines or CSV rows.  Every record
+has a "kind": at most one "conference", any number of "speaker"s, each
+with an import-local "ref", and "session"s naming their speaker by that
+"speakerRef" or by the "websafeSpeakerKey" of an existing Speaker.  In
+CSV the columns are the union of the fields of all kinds and "topics"
+is separated by semicolons.
+
+parse() returns the normalized records -- plain JSON values, ordered
+conference, speakers, sessions -- or raises InvalidImport with the
+problems found and their line numbers.  Building and storing the
+entities is up to the caller; checkSize() tells whether the records,
+once their ids are allocated, still fit on the ImportJob that holds
+them.
+
+"""
+
+import csv
+import json
+import zlib
+from cStringIO import StringIO
+from datetime import datetime
+
+from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
+
+from models import SessionType
+
+FORMATS = ('jsonl', 'csv')
+KINDS = ('conference', 'speaker', 'session')
+MAX_ERRORS = 20
+# compressed records are stored on the ImportJob and rewritten with
+# every batch; stay well below the 1 MB entity limit
+MAX_RECORDS_BYTES = 900 * 1024
+
+
+class InvalidImport(Exception):
+    """Raised by parse() with the problems found in an import."""
+
+    def __init__(self, errors):
+        Exception.__init__(self, '; '.join(errors))
+        self.errors = errors
+
+
+def _string(value, required=False):
+    if value in (None, ''):
+        if required:
+            raise ValueError('is required')
+        return None
+    return unicode(value).strip()
+
+
+def _integer(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _float(value):
+    return float(value) if value not in (None, '') else None
+
+
+def _date(value):
+    if value in (None, ''):
+        return None
+    return str(datetime.strptime(str(value)[:10], '%Y-%m-%d').date())
+
+
+def _time(value):
+    if value in (None, ''):
+        return None
+    return datetime.strptime(str(value), '%H:%M').strftime('%H:%M')
+
+
+def _topics(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, basestring):
+        value = value.split(';')
+    return [unicode(topic).strip() for topic in value if topic]
+
+
+def _speakerKey(value):
+    if value in (None, ''):
+        return None
+    try:
+        key = ndb.Key(urlsafe=str(value))
+    except (TypeError, ProtocolBufferDecodeError):
+        raise ValueError('is not a valid key')
+    if key.kind() != 'Speaker':
+        raise ValueError('is not a speaker key')
+    return unicode(value).strip()
+
+
+def _sessionType(value):
+    if value in (None, ''):
+        return None
+    if str(value) not in SessionType.names():
+        raise ValueError('must be one of %s' % ', '.join(SessionType.names()))
+    return str(value)
+
+
+FIELDS = {
+    'conference': [
+        ('name', lambda v: _string(v, required=True)),
+        ('description', _string),
+        ('city', _string),
+        ('topics', _topics),
+        ('startDate', _date),
+        ('endDate', _date),
+        ('maxAttendees', _integer),
+    ],
+    'speaker': [
+        ('ref', lambda v: _string(v, required=True)),
+        ('name', lambda v: _string(v, required=True)),
+        ('bio', _string),
+        ('age', _integer),
+        ('emailAddress', _string),
+    ],
+    'session': [
+        ('name', lambda v: _string(v, required=True)),
+        ('highlights', _string),
+        ('speakerRef', _string),
+        ('websafeSpeakerKey', _speakerKey),
+        ('duration', _float),
+        ('typeOfSession', _sessionType),
+        ('date', _date),
+        ('startTime', _time),
+    ],
+}
+
+
+def _rows(data, dataFormat):
+    """Yield (line number, raw dict) for each record of data."""
+    if dataFormat == 'jsonl':
+        for number, line in enumerate(data.splitlines(), 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row
+    else:
+        reader = csv.DictReader(StringIO(data.encode('utf-8')))
+        # the header is line 1
+        for number, row in enumerate(reader, 2):
+            yield number, dict((name, value.decode('utf-8'))
+                               for name, value in row.items()
+                               if name and value is not None)
+
+
+def _normalize(row):
+    """Return the normalized record for one raw row."""
+    if not isinstance(row, dict):
+        raise ValueError('not an object')
+    kind = row.get('kind')
+    if kind not in KINDS:
+        raise ValueError('kind must be one of %s' % ', '.join(KINDS))
+    record = {'kind': kind}
+    for name, convert in FIELDS[kind]:
+        try:
+            record[name] = convert(row.get(name))
+        except (TypeError, ValueError) as e:
+            raise ValueError('%s %s' % (name, e))
+    return record
+
+
+def parse(data, dataFormat, hasConference=False):
+    """Return the normalized records of data, conference first, then
+    speakers, then sessions; raise InvalidImport listing the problems.
+    hasConference tells that sessions go to an existing conference."""
+    if dataFormat not in FORMATS:
+        raise InvalidImport(['format must be one of %s' % ', '.join(FORMATS)])
+
+    errors = []
+    records = dict((kind, []) for kind in KINDS)
+    refs = set()
+    sessions = []
+    for number, row in _rows(data, dataFormat):
+        try:
+            record = _normalize(row)
+        except ValueError as e:
+            errors.append('line %d: %s' % (number, e))
+            continue
+        if record['kind'] == 'speaker':
+            if record['ref'] in refs:
+                errors.append('line %d: duplicate speaker ref %s'
+                              % (number, record['ref']))
+            refs.add(record['ref'])
+        elif record['kind'] == 'session':
+            sessions.append((number, record))
+        records[record['kind']].append(record)
+
+    if len(records['conference']) + hasConference != 1:
+        errors.append('exactly one conference is required')
+    for number, record in sessions:
+        if record['speakerRef']:
+            if record['speakerRef'] not in refs:
+                errors.append('line %d: unknown speakerRef %s'
+                              % (number, record['speakerRef']))
+        elif not record['websafeSpeakerKey']:
+            errors.append('line %d: speakerRef or websafeSpeakerKey '
+                          'is required' % number)
+
+    if errors:
+        raise InvalidImport(errors[:MAX_ERRORS])
+    return records['conference'] + records['speaker'] + records['session']
+
+
+def checkSize(records):
+    """Raise InvalidImport if records, compressed as the ImportJob stores
+    them, would come close to the datastore's entity size limit."""
+    size = len(zlib.compress(json.dumps(records)))
+    if size > MAX_RECORDS_BYTES:
+        raise InvalidImport(['import is too large: %d KB compressed, at '
+                             'most %d KB' % (size // 1024,
+                                             MAX_RECORDS_BYTES // 1024)])
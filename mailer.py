@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+mailer.py -- batched outgoing mail through a pull queue
+
+send() renders nothing and sends nothing: it only adds a small task
+naming a template and its context to the "mail" pull queue, so a burst
+of conference creations costs one queue add each.  drain() leases up to
+MAIL_BATCH_SIZE of those tasks at a time, renders them and hands the
+whole batch to one backend connection.  A message that fails to send
+keeps its task, whose lease is extended by an exponential backoff so it
+is retried later; after MAIL_MAX_RETRIES the task is dropped.
+
+The backend is chosen in settings: "appengine" uses the Mail API and
+"smtp" talks to SMTP_HOST:SMTP_PORT, e.g. a local sink started with
+    python -m smtpd -n -c DebuggingServer localhost:1025
+
+"""
+
+import json
+import logging
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+from settings import MAIL_BACKEND
+from settings import SMTP_HOST
+from settings import SMTP_PORT
+
+MAIL_QUEUE = 'mail'
+MAIL_BATCH_SIZE = 100     # tasks leased per batch
+MAIL_MAX_BATCHES = 10     # batches sent per drain
+MAIL_LEASE_SECONDS = 60
+MAIL_MAX_RETRIES = 5
+MAIL_BACKOFF_SECONDS = 30  # doubled on every retry
+
+TEMPLATES = {
+    'conferenceCreated': (
+        'You created a new Conference!',
+        'Hi %(displayName)s,\r\n\r\n'
+        'you have created the following conference:\r\n\r\n'
+        '%(name)s\r\n'
+        'City: %(city)s\r\n'
+        'Dates: %(startDate)s - %(endDate)s\r\n'
+        'Topics: %(topics)s\r\n'
+        'Seats: %(maxAttendees)s\r\n\r\n'
+        '%(description)s\r\n'
+    ),
+    'importFinished': (
+        'Your conference import has finished',
+        'Hi %(displayName)s,\r\n\r\n'
+        'your import into %(name)s has finished: %(speakers)d speakers '
+        'and %(sessions)d sessions were added.\r\n'
+    ),
+}
+
+
+def _sender():
+    return 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+
+
+def send(template, to, **context):
+    """Queue a templated message to address to."""
+    sendAsync(template, to, **context).get_result()
+
+
+def sendAsync(template, to, **context):
+    """Start queueing a templated message; return the queue RPC, which
+    a tasklet can yield."""
+    if template not in TEMPLATES:
+        raise ValueError('Unknown mail template: %s' % template)
+    payload = json.dumps({'template': template, 'to': to,
+                          'context': context})
+    return taskqueue.Queue(MAIL_QUEUE).add_async(
+        taskqueue.Task(payload=payload, method='PULL'))
+
+
+def render(payload):
+    """Return (to, subject, body) for a queued payload."""
+    message = json.loads(payload)
+    subject, body = TEMPLATES[message['template']]
+    return message['to'], subject, body % message['context']
+
+
+class AppEngineBackend(object):
+    """AppEngineBackend -- sends through the App Engine Mail API"""
+
+    def __enter__(self):
+        self._sender = _sender()
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def send(self, to, subject, body):
+        mail.send_mail(self._sender, to, subject, body)
+
+
+class SMTPBackend(object):
+    """SMTPBackend -- sends a whole batch over one SMTP connection"""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT):
+        self._host = host
+        self._port = port
+
+    def __enter__(self):
+        self._sender = _sender()
+        self._smtp = smtplib.SMTP(self._host, self._port)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            self._smtp.close()
+        return False
+
+    def send(self, to, subject, body):
+        message = MIMEText(body, 'plain', 'utf-8')
+        message['Subject'] = subject
+        message['From'] = self._sender
+        message['To'] = to
+        self._smtp.sendmail(self._sender, [to], message.as_string())
+
+
+BACKENDS = {
+    'appengine': AppEngineBackend,
+    'smtp': SMTPBackend,
+}
+
+
+def _sendBatch(queue, tasks, backend):
+    """Send one leased batch; return (sent, retried, dropped)."""
+    done = []
+    retried = dropped = 0
+    for task in tasks:
+        try:
+            backend.send(*render(task.payload))
+            done.append(task)
+        except Exception:
+            if task.retry_count >= MAIL_MAX_RETRIES:
+                logging.exception('Dropping mail task %s after %d retries',
+                                  task.name, task.retry_count)
+                done.append(task)
+                dropped += 1
+            else:
+                logging.warning('Mail task %s failed, retrying',
+                                task.name, exc_info=True)
+                queue.modify_task_lease(
+                    task, MAIL_BACKOFF_SECONDS * 2 ** task.retry_count)
+                retried += 1
+    if done:
+        queue.delete_tasks(done)
+    return len(done) - dropped, retried, dropped
+
+
+def drain(backend=None, batch_size=MAIL_BATCH_SIZE,
+          max_batches=MAIL_MAX_BATCHES):
+    """Send queued messages until the queue is empty or max_batches
+    batches were sent; return counters including messages per second."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    backend = backend or BACKENDS[MAIL_BACKEND]()
+    sent = retried = dropped = 0
+    start = time.time()
+    tasks = queue.lease_tasks(MAIL_LEASE_SECONDS, batch_size)
+    if tasks:
+        with backend:
+            for _ in range(max_batches):
+                batch = _sendBatch(queue, tasks, backend)
+                sent += batch[0]
+                retried += batch[1]
+                dropped += batch[2]
+                if len(tasks) < batch_size:
+                    break
+                tasks = queue.lease_tasks(MAIL_LEASE_SECONDS, batch_size)
+                if not tasks:
+                    break
+
+    elapsed = time.time() - start
+    report = {
+        'sent': sent,
+        'retried': retried,
+        'dropped': dropped,
+        'seconds': round(elapsed, 3),
+        'perSecond': round(sent / elapsed, 1) if elapsed and sent else 0,
+    }
+    if sent or retried or dropped:
+        logging.info('Mail drain: %(sent)d sent, %(retried)d retried, '
+                     '%(dropped)d dropped, %(perSecond).1f msg/s', report)
+    return report
@@ -12,30 +12,42 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import cgi
+import datetime
+import json
+import time
+import zlib
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import admission
+import cache
+import mailer
+import metrics
+import profiler
+from models import RequestProfile
+import seats
+
+EXPORT_KINDS = ('Conference', 'Session', 'Speaker', 'Profile')
+EXPORT_BATCH_SIZE = 500
+EXPORT_MAX_SECONDS = 30  # per response; continue from X-Next-Cursor
+EXPORT_MAX_BYTES = 16 * 1024 * 1024  # responses are buffered, not streamed
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Repair the Announcement and its memcache copy."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
-    def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+class SendMailHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send a batch of queued emails."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(mailer.drain()))
 
 class FeatureSpeakerHandler(webapp2.RequestHandler):
     def post(self):
@@ -43,8 +55,237 @@ class FeatureSpeakerHandler(webapp2.RequestHandler):
         ConferenceApi._featureSpeaker(self.request.get('urlsafeSpeakerKey'), self.request.get('urlsafeConferenceKey'))
 
 
+class UpdateOrganizerDisplayNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer displayName onto a batch of Conferences."""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('userId'), self.request.get('cursor') or None)
+
+
+class BackfillOrganizerDisplayNamesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer displayNames onto a batch of older Conferences."""
+        ConferenceApi._backfillOrganizerDisplayNames(
+            self.request.get('cursor') or None)
+
+
+class StartOrganizerBackfillHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start copying organizer displayNames onto older Conferences."""
+        taskqueue.add(url='/tasks/backfill_organizer_names')
+        self.response.set_status(202)
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy the seat shard total into Conference.seatsAvailable."""
+        seats.reconcile(ndb.Key(
+            urlsafe=self.request.get('websafeConferenceKey')))
+
+
+class AdmitHandler(webapp2.RequestHandler):
+    def post(self):
+        """Settle a batch of queued registration tickets."""
+        admission.admit(ndb.Key(
+            urlsafe=self.request.get('websafeConferenceKey')))
+
+
+class CleanWishlistsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Remove a deleted Session from a batch of Profile wishlists."""
+        ConferenceApi._removeSessionFromWishlists(
+            self.request.get('websafeSessionKey'),
+            self.request.get('cursor') or None)
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move a batch of Profile registration lists to Registrations."""
+        ConferenceApi._migrateRegistrations(self.request.get('cursor') or None)
+
+
+class StartRegistrationMigrationHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving every Profile's registrations to Registrations."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(202)
+
+
+class ImportBatchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Store the next batch of a bulk import."""
+        ConferenceApi._importBatch(self.request.get('websafeImportKey'))
+
+
+def _exportValue(value):
+    """JSON encoding of the property values json cannot handle."""
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Stream entities of one kind as NDJSON, batch by batch.
+
+        ?kind=Session&conference=<websafeConferenceKey>&cursor=<token>
+        &gzip=1 -- when the time budget runs out the response ends early
+        and X-Next-Cursor holds the token to continue from.  Only one
+        batch of entities is held in memory at a time."""
+        kind = self.request.get('kind')
+        if kind not in EXPORT_KINDS:
+            self.abort(400, 'kind must be one of %s' % ', '.join(EXPORT_KINDS))
+        ancestor = None
+        if self.request.get('conference'):
+            ancestor = ndb.Key(urlsafe=self.request.get('conference'))
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = Cursor(urlsafe=self.request.get('cursor'))
+        compress = None
+        if self.request.get('gzip'):
+            # wbits 16 + MAX_WBITS writes the gzip container
+            compress = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+
+        query = ndb.Query(kind=kind, ancestor=ancestor)
+        deadline = time.time() + EXPORT_MAX_SECONDS
+        written = 0
+        more = True
+        while more and time.time() < deadline and written < EXPORT_MAX_BYTES:
+            entities, cursor, more = query.fetch_page(
+                EXPORT_BATCH_SIZE, start_cursor=cursor)
+            lines = ''.join(json.dumps(dict(entity.to_dict(),
+                websafeKey=entity.key.urlsafe()), default=_exportValue) + '\n'
+                for entity in entities)
+            data = compress.compress(lines) if compress else lines
+            self.response.write(data)
+            written += len(data)
+        if compress:
+            self.response.write(compress.flush())
+        if more and cursor:
+            self.response.headers['X-Next-Cursor'] = cursor.urlsafe()
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report entity cache hit and miss counters of this instance."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(cache.stats()))
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    # RPC counts per call above which a method is flagged, e.g. N+1 reads
+    FLAG_RPCS_PER_CALL = 10
+    COLUMNS = ('calls', 'errors', 'meanMs', 'p50Ms', 'p95Ms',
+               'datastoreRpcsPerCall', 'getRpcsPerCall', 'getsPerCall',
+               'putsPerCall', 'queriesPerCall', 'memcacheRpcsPerCall',
+               'memcacheHitsPerCall', 'memcacheMissesPerCall')
+
+    def get(self):
+        """Report per-method latency and RPC counts, as JSON with
+        ?format=json or else as an HTML table."""
+        minutes = int(self.request.get('minutes') or 15)
+        result = metrics.report(minutes)
+        if self.request.get('format') == 'json':
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps(result))
+            return
+
+        out = ['<html><head><title>Metrics</title></head><body>',
+               '<h1>Last %d minutes</h1>' % minutes,
+               '<table border="1" cellpadding="4"><tr><th>method</th>']
+        out.extend('<th>%s</th>' % column for column in self.COLUMNS)
+        out.append('</tr>')
+        for row in result['methods']:
+            flagged = row['datastoreRpcsPerCall'] > self.FLAG_RPCS_PER_CALL
+            out.append('<tr%s><td>%s</td>' % (
+                ' style="background: #fdd"' if flagged else '',
+                cgi.escape(row['name'])))
+            out.extend('<td>%s</td>' % row[column] for column in self.COLUMNS)
+            out.append('</tr>')
+        out.append('</table></body></html>')
+        self.response.write(''.join(out))
+
+
+class ProfilesHandler(webapp2.RequestHandler):
+    LIST_SIZE = 50
+
+    def get(self):
+        """List the latest request profiles, optionally of one name."""
+        query = RequestProfile.query()
+        if self.request.get('name'):
+            query = query.filter(
+                RequestProfile.name == self.request.get('name'))
+        out = ['<html><head><title>Profiles</title></head><body>',
+               '<form method="post">Sample rate: <input name="rate" '
+               'value="%s"> <input type="submit" value="Set"></form>'
+               % profiler.sampleRate(),
+               '<table border="1" cellpadding="4"><tr><th>created</th>'
+               '<th>name</th><th>ms</th><th>pstats</th></tr>']
+        for prof in query.order(-RequestProfile.created).fetch(
+                self.LIST_SIZE):
+            out.append('<tr><td><a href="/admin/profiles/%d">%s</a></td>'
+                       '<td>%s</td><td>%s</td><td><a href="/admin/profiles/'
+                       '%d.pstats">download</a></td></tr>' % (
+                           prof.key.id(), prof.created,
+                           cgi.escape(prof.name), prof.elapsedMs,
+                           prof.key.id()))
+        out.append('</table></body></html>')
+        self.response.write(''.join(out))
+
+    def post(self):
+        """Set the fraction of requests to profile."""
+        profiler.setSampleRate(min(max(float(self.request.get('rate')), 0), 1))
+        self.redirect('/admin/profiles')
+
+
+class ProfileHandler(webapp2.RequestHandler):
+    def get(self, profile_id, download):
+        """Show the top functions of a profile, or download it as
+        pstats data with the .pstats suffix."""
+        prof = RequestProfile.get_by_id(int(profile_id))
+        if not prof:
+            self.abort(404)
+        if download:
+            self.response.headers['Content-Type'] = 'application/octet-stream'
+            self.response.headers['Content-Disposition'] = \
+                'attachment; filename="%s-%s.pstats"' % (
+                    prof.name.strip('/').replace('/', '_'), profile_id)
+            self.response.write(prof.stats)
+            return
+        out = ['<html><head><title>Profile</title></head><body>',
+               '<h1>%s, %d ms</h1>' % (cgi.escape(prof.name), prof.elapsedMs),
+               '<p><a href="/admin/profiles/%s.pstats">download</a></p>'
+               % profile_id,
+               '<table border="1" cellpadding="4"><tr><th>function</th>'
+               '<th>calls</th><th>tottime</th><th>cumtime</th></tr>']
+        out.extend('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (
+            cgi.escape(func), calls, tottime, cumtime)
+            for func, calls, tottime, cumtime in prof.top)
+        out.append('</table></body></html>')
+        self.response.write(''.join(out))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
-    ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/feature_speaker', FeatureSpeakerHandler)
+    ('/crons/send_mail', SendMailHandler),
+    ('/tasks/feature_speaker', FeatureSpeakerHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerDisplayNameHandler),
+    ('/tasks/backfill_organizer_names', BackfillOrganizerDisplayNamesHandler),
+    ('/tasks/reconcile_seats', ReconcileSeatsHandler),
+    ('/tasks/admit', AdmitHandler),
+    ('/tasks/clean_wishlists', CleanWishlistsHandler),
+    ('/tasks/import_batch', ImportBatchHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/admin/backfill_organizer_names', StartOrganizerBackfillHandler),
+    ('/admin/export', ExportHandler),
+    ('/admin/migrate_registrations', StartRegistrationMigrationHandler),
+    ('/admin/metrics', MetricsHandler),
+    ('/admin/profiles', ProfilesHandler),
+    (r'/admin/profiles/(\d+)(\.pstats)?', ProfileHandler),
 ], debug=True)
+app = profiler.middleware(metrics.middleware(app))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+mappers.py -- compiled copiers from ndb entities to ProtoRPC forms
+
+A FormMapper is built once per (model, message) pair.  When it is built
+it works out which message fields have a matching model property and how
+each value has to be converted (dates and times to strings, keys to
+urlsafe strings, stored names to Enum values), so copying an entity is
+a loop over precomputed (field, converter) pairs instead of a
+hasattr/getattr/setattr chain with name comparisons for every field.
+
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+WEBSAFE_KEY_FIELD = 'websafeKey'
+
+
+def toString(value):
+    """Convert a date, time or other value to its string form."""
+    return str(value) if value is not None else None
+
+
+def toUrlsafe(value):
+    """Convert an ndb Key to its urlsafe string."""
+    return value.urlsafe() if value is not None else None
+
+
+def toEnum(enum_type, default=None):
+    """Return a converter from stored enum names to enum_type values."""
+    lookup = dict((name, enum_type.lookup_by_name(name))
+                  for name in enum_type.names())
+    return lambda value: lookup.get(value, default)
+
+
+def defaultConverter(prop, field):
+    """Pick the converter for copying model property prop into message
+    field, or None when the value can be copied as is."""
+    if isinstance(field, messages.EnumField):
+        return toEnum(field.type, field.default)
+    if isinstance(field, messages.StringField):
+        if isinstance(prop, ndb.KeyProperty):
+            return toUrlsafe
+        if isinstance(prop, (ndb.DateProperty, ndb.TimeProperty,
+                             ndb.DateTimeProperty)):
+            return toString
+    return None
+
+
+class FormMapper(object):
+    """FormMapper -- copies entities of one model into one message class"""
+
+    def __init__(self, model, message, converters=None):
+        converters = converters or {}
+        self.message = message
+        self._plan = []
+        self._websafeKey = False
+        for field in message.all_fields():
+            if field.name in converters:
+                self._plan.append((field.name, converters[field.name]))
+            elif field.name in model._properties:
+                self._plan.append((field.name, defaultConverter(
+                    model._properties[field.name], field)))
+            elif field.name == WEBSAFE_KEY_FIELD:
+                self._websafeKey = True
+        self._required = any(field.required
+                             for field in message.all_fields())
+
+    def __call__(self, entity):
+        """Return a new message filled from entity."""
+        form = self.message()
+        for name, convert in self._plan:
+            value = getattr(entity, name, None)
+            if convert is not None:
+                value = convert(value)
+            if value is not None:
+                setattr(form, name, value)
+        if self._websafeKey:
+            form.websafeKey = entity.key.urlsafe()
+        if self._required:
+            form.check_initialized()
+        return form
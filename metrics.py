@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+metrics.py -- per-endpoint latency and RPC counts
+
+middleware() wraps a WSGI application and records, for every request,
+its latency and the datastore and memcache calls it made, under the
+name of the ConferenceApi method (for /_ah/spi/ConferenceApi.<method>)
+or of the request path.  The calls are counted by apiproxy post-call
+hooks into the record of the request running on the current thread.
+
+Records are summed per instance and added every FLUSH_SECONDS into
+memcache windows of WINDOW_SECONDS, so report() can merge the windows of
+all instances for the last hour.  Latencies are kept as histograms over
+LATENCY_BUCKETS milliseconds; percentiles are read off those buckets.
+
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+MEMCACHE_WINDOW_KEY = 'METRICS:%d'
+WINDOW_SECONDS = 60
+WINDOWS_KEPT = 60
+FLUSH_SECONDS = 10
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNTERS = ('calls', 'errors', 'totalMs', 'datastoreRpcs', 'gets',
+            'getRpcs', 'puts', 'queries', 'memcacheRpcs', 'memcacheHits',
+            'memcacheMisses')
+SPI_PREFIX = '/_ah/spi/'
+
+_current = threading.local()
+_lock = threading.Lock()
+_pending = {}
+_flushed = [time.time()]
+
+
+def _newStats():
+    stats = dict((name, 0) for name in COUNTERS)
+    stats['latency'] = [0] * (len(LATENCY_BUCKETS) + 1)
+    return stats
+
+
+def _merge(into, stats):
+    for name in COUNTERS:
+        into[name] += stats[name]
+    into['latency'] = [a + b for a, b in zip(into['latency'],
+                                             stats['latency'])]
+
+
+# - - - RPC hooks - - - - - - - - - - - - - - - - - - - - - - -
+
+def _countRpc(service, call, request, response):
+    """apiproxy post-call hook: count the RPC for the current request."""
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        return
+    if service == 'datastore_v3':
+        stats['datastoreRpcs'] += 1
+        if call == 'Get':
+            stats['getRpcs'] += 1
+            stats['gets'] += len(request.key_list())
+        elif call == 'Put':
+            stats['puts'] += len(request.entity_list())
+        elif call == 'RunQuery':
+            stats['queries'] += 1
+    elif service == 'memcache':
+        stats['memcacheRpcs'] += 1
+        if call == 'Get':
+            hits = len(response.item_list())
+            stats['memcacheHits'] += hits
+            stats['memcacheMisses'] += len(request.key_list()) - hits
+
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'metrics_count_rpc', _countRpc)
+
+
+# - - - recording - - - - - - - - - - - - - - - - - - - - - - -
+
+def callName(environ):
+    """Name a request by its API method or else by its path."""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(SPI_PREFIX):
+        return path[len(SPI_PREFIX):].split('.')[-1]
+    return path
+
+
+def _record(name, stats, elapsed_ms, failed):
+    stats['calls'] = 1
+    stats['errors'] = int(failed)
+    stats['totalMs'] = elapsed_ms
+    bucket = len(LATENCY_BUCKETS)
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed_ms <= bound:
+            bucket = i
+            break
+    stats['latency'][bucket] += 1
+    with _lock:
+        _merge(_pending.setdefault(name, _newStats()), stats)
+
+
+def middleware(app):
+    """Wrap a WSGI application so that every request is recorded."""
+    def measured(environ, start_response):
+        status = []
+
+        def recordingStartResponse(code, headers, exc_info=None):
+            status.append(code)
+            return start_response(code, headers, exc_info)
+
+        _current.stats = _newStats()
+        start = time.time()
+        failed = True
+        try:
+            result = app(environ, recordingStartResponse)
+            failed = not status or status[0][:1] == '5'
+            return result
+        finally:
+            stats, _current.stats = _current.stats, None
+            _record(callName(environ), stats,
+                    (time.time() - start) * 1000, failed)
+            flush()
+    return measured
+
+
+def flush(force=False):
+    """Add this instance's pending stats to the current memcache window,
+    at most every FLUSH_SECONDS."""
+    now = time.time()
+    with _lock:
+        if not _pending or (not force and now - _flushed[0] < FLUSH_SECONDS):
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed[0] = now
+
+    key = MEMCACHE_WINDOW_KEY % (now // WINDOW_SECONDS)
+    client = memcache.Client()
+    for _ in range(3):
+        window = client.gets(key)
+        if window is None:
+            if client.add(key, pending,
+                          time=WINDOW_SECONDS * (WINDOWS_KEPT + 1)):
+                return
+            continue
+        for name, stats in pending.items():
+            _merge(window.setdefault(name, _newStats()), stats)
+        if client.cas(key, window):
+            return
+    # contended; keep the stats for the next flush
+    logging.info('Metrics flush contended, retrying later')
+    with _lock:
+        for name, stats in pending.items():
+            _merge(_pending.setdefault(name, _newStats()), stats)
+
+
+# - - - reporting - - - - - - - - - - - - - - - - - - - - - - -
+
+def _percentile(histogram, fraction):
+    """Upper bound of the bucket holding the given fraction of calls."""
+    target = fraction * sum(histogram)
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+    return None
+
+
+def report(minutes=15):
+    """Return per-name totals and per-call averages over the last
+    minutes, busiest datastore users first."""
+    flush(force=True)
+    current = int(time.time() // WINDOW_SECONDS)
+    windows = min(minutes * 60 // WINDOW_SECONDS, WINDOWS_KEPT) or 1
+    cached = memcache.get_multi([MEMCACHE_WINDOW_KEY % w for w in
+                                 range(current - windows + 1, current + 1)])
+    totals = collections.defaultdict(_newStats)
+    for window in cached.values():
+        for name, stats in window.items():
+            _merge(totals[name], stats)
+
+    rows = []
+    for name, stats in totals.items():
+        calls = float(stats['calls']) or 1
+        row = {'name': name, 'calls': stats['calls'],
+               'errors': stats['errors'],
+               'meanMs': round(stats['totalMs'] / calls, 1),
+               'p50Ms': _percentile(stats['latency'], 0.5),
+               'p95Ms': _percentile(stats['latency'], 0.95),
+               'latency': stats['latency']}
+        for counter in COUNTERS[3:]:
+            row[counter + 'PerCall'] = round(stats[counter] / calls, 2)
+        rows.append(row)
+    rows.sort(key=lambda row: -row['datastoreRpcsPerCall'])
+    return {'minutes': minutes, 'latencyBuckets': LATENCY_BUCKETS,
+            'methods': rows}
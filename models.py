@@ -13,6 +13,7 @@ created/forked from conferences.py by wesc on 2014 may 24
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import httplib
+import time
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
@@ -44,6 +45,8 @@ class ProfileForm(messages.Message):
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
 
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
@@ -54,6 +57,7 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -61,6 +65,59 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+    sessionsVersion = ndb.IntegerProperty(default=0, indexed=False)
+    queuedRegistration = ndb.BooleanProperty(default=False, indexed=False)
+
+    def _pre_put_hook(self):
+        # every write stamps a new version; ETags are derived from it
+        self.version = nextVersion(self.version)
+
+def nextVersion(version):
+    """Return a version stamp newer than version."""
+    return max(int(time.time() * 1000), (version or 0) + 1)
+
+class Announcement(ndb.Model):
+    """Announcement -- conferences that are nearly sold out"""
+    conferences     = ndb.JsonProperty() # websafe key -> conference name
+
+class SeatShard(ndb.Model):
+    """SeatShard -- slice of a Conference's available seats"""
+    conferenceKey   = ndb.KeyProperty(kind=Conference)
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+    attendees       = ndb.IntegerProperty(indexed=False) # None until seeded
+
+class Registration(ndb.Model):
+    """Registration -- a Profile's seat at a Conference; child of the
+    Profile, keyed by the Conference's urlsafe key"""
+    conferenceKey   = ndb.KeyProperty(kind=Conference)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+def registrationKey(user_id, conference_key):
+    """Return the key of the Registration of user_id at a Conference."""
+    return ndb.Key(Profile, user_id, Registration, conference_key.urlsafe())
+
+class AdmissionQueue(ndb.Model):
+    """AdmissionQueue -- waitlist sequence of a queued-registration
+    Conference; parent of its AdmissionWaiters, keyed by the
+    Conference's urlsafe key"""
+    head            = ndb.IntegerProperty(default=1, indexed=False) # first waiting
+    nextSequence    = ndb.IntegerProperty(default=1, indexed=False)
+
+class AdmissionWaiter(ndb.Model):
+    """AdmissionWaiter -- a waitlisted user; child of the AdmissionQueue,
+    keyed by its arrival sequence"""
+    userId          = ndb.StringProperty(indexed=False)
+
+class AdmissionTicket(ndb.Model):
+    """AdmissionTicket -- a Profile's queued registration request and
+    its outcome; child of the Profile, keyed by the Conference's
+    urlsafe key"""
+    ticket          = ndb.StringProperty(indexed=False)
+    status          = ndb.StringProperty(indexed=False)
+    sequence        = ndb.IntegerProperty(indexed=False) # while waitlisted
+    created         = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -76,10 +133,47 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
+    queuedRegistration = messages.BooleanField(15)
+
+class DashboardForm(messages.Message):
+    """DashboardForm -- everything the front end loads on page load"""
+    profile = messages.MessageField(ProfileForm, 1)
+    conferencesToAttend = messages.MessageField(ConferenceForm, 2, repeated=True)
+    announcement = messages.StringField(3)
+    featuredSpeaker = messages.StringField(4)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class TicketStatus(messages.Enum):
+    """TicketStatus -- queued registration outcome enumeration value"""
+    QUEUED = 1
+    REGISTERED = 2
+    WAITLISTED = 3
+    ALREADY_REGISTERED = 4
+
+class TicketForm(messages.Message):
+    """TicketForm -- queued registration ticket outbound form message"""
+    ticket = messages.StringField(1)
+    status = messages.EnumField('TicketStatus', 2)
+    waitlistPosition = messages.IntegerField(3)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- Conference attendee outbound form message"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    teeShirtSize = messages.EnumField('TeeShirtSize', 3)
+    registered = messages.StringField(4)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- one page of Conference attendees"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    attendees = messages.IntegerField(3)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -108,6 +202,15 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple Session filters inbound form message"""
+    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    websafeConferenceKey = messages.StringField(2)
+    pageSize = messages.IntegerField(3, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(4)
 
 class Speaker(ndb.Model):
     """Speaker -- Speaker object"""
@@ -127,6 +230,7 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """SpeakerForms -- Speaker forms"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class SessionType(messages.Enum):
     """SessionType -- enumeration value for session type"""
@@ -146,6 +250,14 @@ class Session(ndb.Model):
     date = ndb.DateProperty()
     startTime = ndb.TimeProperty()
 
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- sessions of one Speaker at one Conference;
+    child of the Conference, keyed by the Speaker's urlsafe key"""
+    conferenceName = ndb.StringProperty(indexed=False)
+    speakerName = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind=Session, repeated=True, indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+
 class SessionForm(messages.Message):
     """SessionForm -- getSessionsBySpeker outbound form"""
     conferenceKey = messages.StringField(1)
@@ -159,8 +271,47 @@ class SessionForm(messages.Message):
     websafeKey = messages.StringField(9)
 
 
+class WishlistForm(messages.Message):
+    """WishlistForm -- batch wishlist change inbound form message"""
+    websafeSessionKeys = messages.StringField(1, repeated=True)
+
 class SessionForms(messages.Message):
     """SessionForms -- getConferenceSessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+
+class ImportJob(ndb.Model):
+    """ImportJob -- progress of a bulk import, resumable by batch"""
+    organizerUserId = ndb.StringProperty()
+    conferenceKey   = ndb.KeyProperty(kind=Conference)
+    newConference   = ndb.BooleanProperty(default=False, indexed=False)
+    records         = ndb.JsonProperty(compressed=True) # with allocated ids
+    total           = ndb.IntegerProperty(default=0, indexed=False)
+    processed       = ndb.IntegerProperty(default=0, indexed=False)
+    status          = ndb.StringProperty(default='queued')
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class ImportForm(messages.Message):
+    """ImportForm -- bulk import inbound form message"""
+    format = messages.StringField(1, default='jsonl')
+    data = messages.StringField(2, required=True)
+    websafeConferenceKey = messages.StringField(3)
 
+class ImportStatusForm(messages.Message):
+    """ImportStatusForm -- bulk import progress outbound form message"""
+    websafeKey = messages.StringField(1)
+    status = messages.StringField(2)
+    total = messages.IntegerField(3)
+    processed = messages.IntegerField(4)
+    websafeConferenceKey = messages.StringField(5)
 
+class RequestProfile(ndb.Model):
+    """RequestProfile -- cProfile stats of one sampled request"""
+    name            = ndb.StringProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    elapsedMs       = ndb.IntegerProperty(indexed=False)
+    top             = ndb.JsonProperty() # [function, calls, tottime, cumtime]
+    stats           = ndb.BlobProperty(compressed=True) # marshalled pstats
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+planner.py -- multi-field filter planning for datastore queries
+
+The datastore only accepts inequality filters on one property per
+query.  QueryPlanner lifts that restriction: it pushes every equality
+filter and the inequality filters of one property down into the
+datastore query, and evaluates the remaining filters in memory while
+streaming the results.  When inequalities on several properties are
+given, the property whose pushed-down query matches the fewest entities
+(estimated with bounded keys-only counts run in parallel) is chosen.
+
+"!=" is never pushed down: ndb runs it as two merged queries, which
+cannot be resumed from a cursor.
+
+Pushed-down combinations may need a composite index that index.yaml
+does not declare.  Every Plan therefore carries less selective
+fallbacks -- the equality filters alone, then no filters at all -- that
+the built-in indexes can serve.  A query that fails with NeedIndexError
+is remembered per instance by its shape -- ancestor, filtered fields
+and operators, sort order -- and its fallback is used instead, with the
+dropped filters evaluated in memory.
+
+"""
+
+import collections
+import logging
+
+from google.appengine.api import datastore_errors
+
+SAMPLE_LIMIT = 1000  # keys counted per candidate when estimating
+MAX_SCAN = 2000      # entities read per page before returning early
+RUN_BATCH_SIZE = 100 # entities per page when run() reads a whole plan
+
+Filter = collections.namedtuple('Filter', 'field operator value')
+
+_COMPARE = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def matches(entity, filtr):
+    """Evaluate filtr against entity the way the datastore would; a
+    repeated property matches if any of its values does."""
+    value = getattr(entity, filtr.field, None)
+    values = value if isinstance(value, list) else [value]
+    compare = _COMPARE[filtr.operator]
+    return any(v is not None and compare(v, filtr.value) for v in values)
+
+
+class Plan(object):
+    """Plan -- a pushed-down datastore query plus residual filters"""
+
+    def __init__(self, query, residual, shape=None, fallbacks=()):
+        self.query = query
+        self.residual = residual
+        self.shape = shape
+        self.fallbacks = list(fallbacks)  # (query, residual, shape)
+
+    def fallBack(self):
+        """Switch to the next less selective query; False if none."""
+        if not self.fallbacks:
+            return False
+        self.query, self.residual, self.shape = self.fallbacks.pop(0)
+        return True
+
+    def accepts(self, entity):
+        return all(matches(entity, filtr) for filtr in self.residual)
+
+
+class QueryPlanner(object):
+    """QueryPlanner -- plans filtered queries over one model"""
+
+    def __init__(self, model, order=(), sample_limit=SAMPLE_LIMIT,
+                 max_scan=MAX_SCAN):
+        self._model = model
+        self._order = list(order)
+        self._sample_limit = sample_limit
+        self._max_scan = max_scan
+        self._unindexed = set()  # shapes of queries that needed an index
+
+    def _query(self, filters, ancestor=None, order_field=None,
+               unordered=False):
+        """Return (query, shape) for filters; shape identifies the index
+        the query needs, whatever the filter values."""
+        q = self._model.query(ancestor=ancestor)
+        for filtr in filters:
+            # the property converts the value to its datastore type
+            q = q.filter(self._model._properties[filtr.field]._comparison(
+                filtr.operator, filtr.value))
+        order = []
+        # the inequality property must be the first sort order
+        if order_field:
+            order.append(self._model._properties[order_field])
+        if not unordered:
+            order.extend(self._order)
+        if order:
+            q = q.order(*order)
+        shape = (ancestor is not None,
+                 frozenset((f.field, f.operator) for f in filters),
+                 tuple(repr(o) for o in order))
+        return q, shape
+
+    def _count(self, future):
+        """Result of an estimating count; unindexed candidates count as
+        the sample limit."""
+        try:
+            return future.get_result()
+        except datastore_errors.NeedIndexError:
+            return self._sample_limit
+
+    def plan(self, filters, ancestor=None):
+        """Return the Plan for a list of Filters."""
+        equalities = [f for f in filters if f.operator == '=']
+        ranges = collections.OrderedDict()
+        residual = []
+        for filtr in filters:
+            if filtr.operator == '!=':
+                residual.append(filtr)
+            elif filtr.operator != '=':
+                ranges.setdefault(filtr.field, []).append(filtr)
+        inequalities = [f for f in filters if f.operator != '=']
+        # served by the built-in indexes: equalities are merge-joined
+        query, shape = self._query([], ancestor, unordered=True)
+        fallbacks = [(query, list(filters), shape)]
+        if equalities:
+            query, shape = self._query(equalities, ancestor, unordered=True)
+            fallbacks.insert(0, (query, inequalities, shape))
+
+        if not ranges:
+            query, shape = self._query(equalities, ancestor)
+            plan = Plan(query, residual, shape,
+                        fallbacks if self._order else fallbacks[1:])
+            return self._usable(plan)
+
+        if len(ranges) == 1:
+            field = ranges.keys()[0]
+        else:
+            # estimate each candidate with a bounded keys-only count; no
+            # sort order, which would have to start with the candidate
+            counts = dict((candidate, self._query(
+                equalities + candidate_filters, ancestor,
+                unordered=True)[0].count_async(limit=self._sample_limit))
+                for candidate, candidate_filters in ranges.items())
+            field = min(ranges, key=lambda candidate:
+                        self._count(counts[candidate]))
+
+        for candidate, candidate_filters in ranges.items():
+            if candidate != field:
+                residual.extend(candidate_filters)
+        query, shape = self._query(equalities + ranges[field], ancestor,
+                                   field)
+        return self._usable(Plan(query, residual, shape, fallbacks))
+
+    def _usable(self, plan):
+        """Skip the queries of plan already known to need an index."""
+        while plan.shape in self._unindexed and plan.fallBack():
+            pass
+        return plan
+
+    def _attempt(self, plan, read):
+        """Return read(plan), falling back to less selective queries
+        while the datastore lacks an index for the current one."""
+        while True:
+            try:
+                return read(plan)
+            except datastore_errors.NeedIndexError:
+                self._unindexed.add(plan.shape)
+                logging.warning('No index for %r, using a fallback query',
+                                plan.query)
+                if not plan.fallBack():
+                    raise
+
+    def fetchPage(self, plan, page_size, start_cursor=None):
+        """Return (results, cursor, more) for one page of plan.  At most
+        max_scan entities are read, so a page may come back short with
+        more set when the residual filters reject most of them."""
+        return self._attempt(plan, lambda plan: self._fetchPage(
+            plan, page_size, start_cursor))
+
+    def _fetchPage(self, plan, page_size, start_cursor):
+        if not plan.residual:
+            return plan.query.fetch_page(page_size, start_cursor=start_cursor)
+
+        results = []
+        scanned = 0
+        it = plan.query.iter(start_cursor=start_cursor, produce_cursors=True,
+                             batch_size=page_size)
+        for entity in it:
+            scanned += 1
+            if plan.accepts(entity):
+                results.append(entity)
+            if len(results) == page_size or scanned >= self._max_scan:
+                return results, it.cursor_after(), it.has_next()
+        return results, None, False
+
+    def run(self, plan):
+        """Yield every entity matching plan."""
+        cursor, more = None, True
+        while more:
+            entities, cursor, more = self._attempt(
+                plan, lambda plan: plan.query.fetch_page(
+                    RUN_BATCH_SIZE, start_cursor=cursor))
+            for entity in entities:
+                if plan.accepts(entity):
+                    yield entity
+            if not cursor:
+                break
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+profiler.py -- cProfile sampling of live requests
+
+middleware() wraps a WSGI application and runs a fraction of its
+requests under cProfile: every request carrying PROFILE_HEADER from an
+administrator, and otherwise a random sample at the rate set from
+/admin/profiles (kept in memcache, re-read by each instance every
+RATE_CACHE_SECONDS).  Each profile is stored as a RequestProfile with
+the marshalled pstats data, loadable with pstats.Stats, and the top
+functions by cumulative time for browsing.
+
+"""
+
+import cProfile
+import logging
+import marshal
+import pstats
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import users
+
+from models import RequestProfile
+import metrics
+
+PROFILE_HEADER = 'HTTP_X_CONFERENCE_PROFILE'
+MEMCACHE_RATE_KEY = 'PROFILE_SAMPLE_RATE'
+RATE_CACHE_SECONDS = 30
+TOP_FUNCTIONS = 25
+
+_rate = [0.0, 0]  # sample rate, when it was read
+
+
+def sampleRate():
+    """Return the fraction of requests to profile."""
+    if _rate[1] + RATE_CACHE_SECONDS < time.time():
+        _rate[:] = [memcache.get(MEMCACHE_RATE_KEY) or 0.0, time.time()]
+    return _rate[0]
+
+
+def setSampleRate(rate):
+    memcache.set(MEMCACHE_RATE_KEY, float(rate))
+    _rate[:] = [float(rate), time.time()]
+
+
+def _wanted(environ):
+    if environ.get(PROFILE_HEADER):
+        return users.is_current_user_admin()
+    rate = sampleRate()
+    return rate > 0 and random.random() < rate
+
+
+def _describe(func):
+    filename, line, name = func
+    return '%s:%d(%s)' % (filename, line, name)
+
+
+def _store(name, profile, elapsed_ms):
+    stats = pstats.Stats(profile)
+    top = sorted(stats.stats.items(), key=lambda item: -item[1][3])
+    RequestProfile(
+        name=name,
+        elapsedMs=int(elapsed_ms),
+        top=[[_describe(func), calls, round(tottime, 4), round(cumtime, 4)]
+             for func, (_, calls, tottime, cumtime, _) in
+             top[:TOP_FUNCTIONS]],
+        stats=marshal.dumps(stats.stats),
+    ).put()
+
+
+def middleware(app):
+    """Wrap a WSGI application so that sampled requests are profiled."""
+    def profiled(environ, start_response):
+        if not _wanted(environ):
+            return app(environ, start_response)
+        profile = cProfile.Profile()
+        start = time.time()
+        try:
+            return profile.runcall(app, environ, start_response)
+        finally:
+            try:
+                _store(metrics.callName(environ), profile,
+                       (time.time() - start) * 1000)
+            except Exception:
+                # profiling must never fail the request
+                logging.exception('Cannot store request profile')
+    return profiled
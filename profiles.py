@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+profiles.py -- request-scoped and memcache copies of user Profiles
+
+Most authenticated endpoints start by loading the caller's Profile,
+often more than once per request.  get() keeps each Profile it returns
+for the rest of the request and mirrors it in memcache for
+PROFILE_MEMCACHE_TTL seconds, so a request reads it at most once and
+rarely from the datastore.
+
+Every Profile write must be followed by invalidate().  It drops the
+copies and, through memcache.delete(seconds=...), keeps readers that
+loaded the old Profile before the write from re-adding it to memcache
+for a short while; memcache entries are only ever created with add().
+
+"""
+
+import os
+import threading
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Profile
+
+MEMCACHE_PROFILE_KEY = 'PROFILE:%s'
+PROFILE_MEMCACHE_TTL = 60
+PROFILE_LOCK_SECONDS = 5  # after a write, stale copies cannot be re-added
+
+_context = threading.local()
+
+
+def _requestProfiles():
+    """Return the Profiles seen by the current request, by user id."""
+    request_id = os.environ.get('REQUEST_LOG_ID')
+    if getattr(_context, 'requestId', None) != request_id:
+        _context.requestId = request_id
+        _context.profiles = {}
+    return _context.profiles
+
+
+def get(user_id):
+    """Return the Profile of user_id, or None if it does not exist."""
+    return getAsync(user_id).get_result()
+
+
+@ndb.tasklet
+def getAsync(user_id):
+    """Tasklet version of get(), so the Profile can load while the
+    caller's other RPCs are in flight."""
+    p_key = ndb.Key(Profile, user_id)
+    if ndb.in_transaction():
+        # transactional reads must see (and lock) the datastore entity
+        profile = yield p_key.get_async()
+        raise ndb.Return(profile)
+
+    profiles = _requestProfiles()
+    profile = profiles.get(user_id)
+    if profile is not None:
+        raise ndb.Return(profile)
+
+    ctx = ndb.get_context()
+    profile = yield ctx.memcache_get(MEMCACHE_PROFILE_KEY % user_id)
+    if profile is None:
+        profile = yield p_key.get_async()
+        if profile is None:
+            raise ndb.Return(None)
+        yield ctx.memcache_add(MEMCACHE_PROFILE_KEY % user_id, profile,
+                               time=PROFILE_MEMCACHE_TTL)
+    profiles[user_id] = profile
+    raise ndb.Return(profile)
+
+
+def invalidate(*keys):
+    """Drop the cached copies of the given Profile keys; inside a
+    transaction this happens once the transaction commits."""
+    if ndb.in_transaction():
+        ndb.get_context().call_on_commit(lambda: invalidate(*keys))
+        return
+
+    profiles = _requestProfiles()
+    for key in keys:
+        profiles.pop(key.id(), None)
+    memcache.delete_multi([MEMCACHE_PROFILE_KEY % key.id() for key in keys],
+                          seconds=PROFILE_LOCK_SECONDS)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+seats.py -- sharded seat allocation for Conference registration
+
+Seats of a Conference are split across NUM_SHARDS SeatShard root
+entities so that registrations touch a randomly chosen shard instead of
+contending on the single Conference entity group.  A shard never goes
+below zero seats and seats only move between shards inside
+transactions, so the sum over the shards can never exceed maxAttendees.
+Conference.seatsAvailable is kept as a reconciled view of that sum by
+a coalesced background task, or right away by the registration itself
+once the view is close to selling out.
+
+Each shard also counts the attendees whose seat it handed out or took
+back, in the same transaction as the Registration, so attendeeCount()
+is exact without counting Registrations.  Shards stored before the
+count existed are seeded from maxAttendees the first time it is read.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+import announcements
+import cache
+
+NUM_SHARDS = 20
+RECONCILE_WINDOW = 5  # seconds between seatsAvailable reconciliations
+WATCH_SEATS = 25      # reconcile synchronously at or below this view
+
+
+class ShardExhausted(Exception):
+    """Raised inside a transaction when the chosen shard has no seats."""
+
+
+def shardKeys(conf):
+    """Return the SeatShard keys of a Conference."""
+    prefix = conf.key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (prefix, i))
+            for i in range(conf.seatShards or 0)]
+
+
+def _spread(total, parts, i):
+    """Share of part i when total is split evenly over parts."""
+    return total // parts + (1 if i < total % parts else 0)
+
+
+def _buildShards(conf, num_shards=NUM_SHARDS):
+    """Split conf.seatsAvailable, and the attendees holding the other
+    seats, evenly over num_shards new shards."""
+    conf.seatShards = num_shards
+    seats = max(conf.seatsAvailable or 0, 0)
+    attendees = max((conf.maxAttendees or 0) - seats, 0)
+    return [SeatShard(key=key, conferenceKey=conf.key,
+                      seatsAvailable=_spread(seats, num_shards, i),
+                      attendees=_spread(attendees, num_shards, i))
+            for i, key in enumerate(shardKeys(conf))]
+
+
+def putWithShards(conf):
+    """Store a new Conference together with its seat shards."""
+    shards = _buildShards(conf)
+    ndb.transaction(lambda: ndb.put_multi([conf] + shards), xg=True)
+    return conf
+
+
+def ensureShards(conf):
+    """Return conf, creating shards first for conferences stored before
+    seat sharding existed."""
+    if conf.seatShards:
+        return conf
+
+    @ndb.transactional(xg=True)
+    def _create():
+        current = conf.key.get()
+        if not current.seatShards:
+            ndb.put_multi([current] + _buildShards(current))
+            cache.invalidate(current.key)
+        return current
+    return _create()
+
+
+def candidateShards(conf):
+    """Return the keys of shards that had seats left, in random order."""
+    shards = ndb.get_multi(shardKeys(conf))
+    keys = [shard.key for shard in shards
+            if shard and shard.seatsAvailable > 0]
+    random.shuffle(keys)
+    return keys
+
+
+def takeSeat(shard_key):
+    """Take one seat from a shard; must run inside a transaction."""
+    shard = shard_key.get()
+    if not shard or shard.seatsAvailable <= 0:
+        raise ShardExhausted()
+    shard.seatsAvailable -= 1
+    if shard.attendees is not None:
+        shard.attendees += 1
+    return shard
+
+
+def takeSeats(shard_keys, count):
+    """Take up to count seats from the given shards, in order; must run
+    inside a transaction.  Return (seats taken, shards to put)."""
+    taken, changed = 0, []
+    for shard_key in shard_keys:
+        if taken == count:
+            break
+        shard = shard_key.get()
+        if not shard or shard.seatsAvailable <= 0:
+            continue
+        granted = min(shard.seatsAvailable, count - taken)
+        shard.seatsAvailable -= granted
+        if shard.attendees is not None:
+            shard.attendees += granted
+        taken += granted
+        changed.append(shard)
+    return taken, changed
+
+
+def returnSeat(conf):
+    """Give one seat back to a random shard; must run inside a
+    transaction."""
+    shard = random.choice(shardKeys(conf)).get()
+    shard.seatsAvailable += 1
+    if shard.attendees is not None:
+        # a shard's count may go below zero; only the sum is meaningful
+        shard.attendees -= 1
+    return shard
+
+
+def resizeShards(conf, delta):
+    """Add (or remove, when negative) delta seats across the shards;
+    must run inside an xg transaction.  Return the shards to put, or
+    None when not enough unregistered seats are left to remove."""
+    shards = ndb.get_multi(shardKeys(conf))
+    if delta >= 0:
+        shard = random.choice(shards)
+        shard.seatsAvailable += delta
+        return [shard]
+
+    changed = []
+    needed = -delta
+    for shard in sorted(shards, key=lambda s: -s.seatsAvailable):
+        if not needed:
+            break
+        taken = min(shard.seatsAvailable, needed)
+        if taken:
+            shard.seatsAvailable -= taken
+            needed -= taken
+            changed.append(shard)
+    if needed:
+        return None
+    return changed
+
+
+def seatsAvailable(conf):
+    """Return the number of seats left, summed over the shards."""
+    return sum(shard.seatsAvailable
+               for shard in ndb.get_multi(shardKeys(conf)) if shard)
+
+
+def attendeeCount(conf):
+    """Return the number of registered attendees, summed over the
+    shards."""
+    if not conf.seatShards:
+        return max((conf.maxAttendees or 0) - (conf.seatsAvailable or 0), 0)
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf)) if shard]
+    if any(shard.attendees is None for shard in shards):
+        shards = _seedAttendees(conf.key)
+    return sum(shard.attendees for shard in shards)
+
+
+@ndb.transactional(xg=True)
+def _seedAttendees(conf_key):
+    """Set the attendee counts of shards stored before they existed to
+    the seats taken; return the shards."""
+    conf = conf_key.get()
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf)) if shard]
+    if any(shard.attendees is None for shard in shards):
+        taken = max((conf.maxAttendees or 0) -
+                    sum(shard.seatsAvailable for shard in shards), 0)
+        for i, shard in enumerate(shards):
+            shard.attendees = _spread(taken, len(shards), i)
+        ndb.put_multi(shards)
+    return shards
+
+
+def scheduleReconcile(conf_key, coalesce=True):
+    """Enqueue a seatsAvailable reconciliation for the conference; when
+    coalescing, requests within the same window share one task."""
+    params = {'websafeConferenceKey': conf_key.urlsafe()}
+    if not coalesce:
+        taskqueue.add(params=params, url='/tasks/reconcile_seats',
+                      countdown=RECONCILE_WINDOW)
+        return
+    window = int(time.time() // RECONCILE_WINDOW)
+    try:
+        taskqueue.add(params=params,
+            url='/tasks/reconcile_seats',
+            name='reconcile-%s-%d' % (conf_key.urlsafe(), window),
+            countdown=RECONCILE_WINDOW
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def isWatched(conf):
+    """True when conf is close enough to selling out that its view must
+    be reconciled on every registration."""
+    return (conf.seatsAvailable or 0) <= WATCH_SEATS
+
+
+def reconcile(conf_key):
+    """Copy the shard total into Conference.seatsAvailable and update
+    the nearly sold out announcement.  The shards are summed inside the
+    transaction (NUM_SHARDS + 1 entity groups), so an older total can
+    never be written last; when registrations keep the transaction from
+    committing, another reconciliation is scheduled instead."""
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return conf
+
+    @ndb.transactional(xg=True)
+    def _update():
+        current = conf_key.get()
+        total = seatsAvailable(current)
+        if current.seatsAvailable != total:
+            current.seatsAvailable = total
+            current.put()
+            cache.invalidate(current.key)
+        return current
+    try:
+        conf = _update()
+    except datastore_errors.TransactionFailedError:
+        # the window's named task may be the one running this
+        scheduleReconcile(conf_key, coalesce=False)
+        return conf
+    announcements.update(conf)
+    return conf
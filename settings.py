@@ -16,3 +16,20 @@ WEB_CLIENT_ID = '877465468733-acnamd40pbgm2ls7m530sd9b2angdihi.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Entity cache: a bounded per-instance LRU in front of memcache.
+# Instance entries are only trusted for ENTITY_CACHE_TTL seconds, which
+# bounds how stale another instance's write can look.
+ENTITY_CACHE_SIZE = 1000
+ENTITY_CACHE_TTL = 5
+ENTITY_MEMCACHE_TTL = 600
+
+# Outgoing mail: "appengine" for the Mail API, "smtp" to relay through
+# SMTP_HOST:SMTP_PORT (e.g. a local sink while testing).
+MAIL_BACKEND = 'appengine'
+SMTP_HOST = 'localhost'
+SMTP_PORT = 1025
+
+# Verified OAuth tokens are remembered, by hash, for at most this long.
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TTL = 300
@@ -62,6 +62,35 @@ app.filter('startFrom', function () {
     return filter;
 });
 
+/**
+ * @ngdoc directive
+ * @name infiniteScroll
+ *
+ * @description
+ * A directive that evaluates its expression whenever the window is scrolled close to the bottom of the element.
+ * The distance in pixels can be set with the infinite-scroll-distance attribute.
+ *
+ */
+app.directive('infiniteScroll', function ($window) {
+    return {
+        link: function (scope, element, attrs) {
+            var distance = parseInt(attrs.infiniteScrollDistance, 10) || 200;
+
+            var onScroll = function () {
+                var bottom = element[0].getBoundingClientRect().bottom;
+                if (bottom - $window.innerHeight <= distance) {
+                    scope.$apply(attrs.infiniteScroll);
+                }
+            };
+
+            angular.element($window).on('scroll', onScroll);
+            scope.$on('$destroy', function () {
+                angular.element($window).off('scroll', onScroll);
+            });
+        }
+    };
+});
+
 
 /**
  * @ngdoc constant
@@ -130,3 +159,89 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name responseCache
+ *
+ * @description
+ * Service that keeps the last response of each ETag-aware API call, so that
+ * its etag can be sent back and a notModified reply answered from here.
+ *
+ */
+app.factory('responseCache', function () {
+    var responses = {};
+
+    return {
+        /**
+         * Returns the request params extended with the etag of the cached
+         * response, if any.
+         */
+        withEtag: function (name, params) {
+            var cached = responses[name + JSON.stringify(params)];
+            return angular.extend({}, params, cached ? {etag: cached.etag} : {});
+        },
+
+        /**
+         * Returns the fresh result, storing it, or the cached one when the
+         * server replied notModified.
+         */
+        resolve: function (name, params, result) {
+            var key = name + JSON.stringify(params);
+            if (result.notModified && responses[key]) {
+                return responses[key];
+            }
+            if (result.etag) {
+                responses[key] = result;
+            }
+            return result;
+        }
+    };
+});
+
+
+/**
+ * @ngdoc service
+ * @name dashboard
+ *
+ * @description
+ * Service that loads the profile, the conferences to attend, the announcement and
+ * the featured speaker with one conference.getDashboard call, shared by all controllers.
+ *
+ */
+app.factory('dashboard', function ($q, $rootScope) {
+    var pending = null;
+
+    return {
+        /**
+         * Returns a promise of the getDashboard result; the API is called once
+         * until invalidate() is invoked.  The promise is rejected with the response
+         * when the call fails.
+         */
+        load: function () {
+            if (!pending) {
+                var deferred = $q.defer();
+                pending = deferred.promise;
+                gapi.client.conference.getDashboard().execute(function (resp) {
+                    $rootScope.$apply(function () {
+                        if (resp.error) {
+                            pending = null;
+                            deferred.reject(resp);
+                        } else {
+                            deferred.resolve(resp.result);
+                        }
+                    });
+                });
+            }
+            return pending;
+        },
+
+        /**
+         * Forgets the loaded dashboard after a change it reflects, e.g. a registration.
+         */
+        invalidate: function () {
+            pending = null;
+        }
+    };
+});
@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, HTTP_ERRORS, dashboard) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,21 +63,16 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
-                        $scope.$apply(function () {
-                            $scope.loading = false;
-                            if (resp.error) {
-                                // Failed to get a user profile.
-                            } else {
-                                // Succeeded to get the user profile.
-                                $scope.profile.displayName = resp.result.displayName;
-                                $scope.profile.teeShirtSize = resp.result.teeShirtSize;
-                                $scope.initialProfile = resp.result;
-                            }
-                        });
-                    }
-                );
+                dashboard.load().then(function (result) {
+                    // Succeeded to get the user profile.
+                    $scope.loading = false;
+                    $scope.profile.displayName = result.profile.displayName;
+                    $scope.profile.teeShirtSize = result.profile.teeShirtSize;
+                    $scope.initialProfile = result.profile;
+                }, function () {
+                    // Failed to get a user profile.
+                    $scope.loading = false;
+                });
             };
             if (!oauth2Provider.signedIn) {
                 var modalInstance = oauth2Provider.showLoginModal();
@@ -111,6 +106,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
                             }
                         } else {
                             // The request has succeeded.
+                            dashboard.invalidate();
                             $scope.messages = 'The profile has been updated';
                             $scope.alertStatus = 'success';
                             $scope.submitted = false;
@@ -249,7 +245,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS, dashboard) {
 
     /**
      * Holds the status if the query is being executed.
@@ -340,44 +336,22 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Namespace for the pagination.
-     * @type {{}|*}
+     * The number of the conferences requested per page.
+     * @type {number}
      */
-    $scope.pagination = $scope.pagination || {};
-    $scope.pagination.currentPage = 0;
-    $scope.pagination.pageSize = 20;
-    /**
-     * Returns the number of the pages in the pagination.
-     *
-     * @returns {number}
-     */
-    $scope.pagination.numberOfPages = function () {
-        return Math.ceil($scope.conferences.length / $scope.pagination.pageSize);
-    };
+    $scope.pageSize = 20;
 
     /**
-     * Returns an array including the numbers from 1 to the number of the pages.
-     *
-     * @returns {Array}
+     * Holds the token of the next page of the current query, null when there are no more results.
+     * @type {string|null}
      */
-    $scope.pagination.pageArray = function () {
-        var pages = [];
-        var numberOfPages = $scope.pagination.numberOfPages();
-        for (var i = 0; i < numberOfPages; i++) {
-            pages.push(i);
-        }
-        return pages;
-    };
+    $scope.nextPageToken = null;
 
     /**
-     * Checks if the target element that invokes the click event has the "disabled" class.
-     *
-     * @param event the click event
-     * @returns {boolean} if the target element that has been clicked has the "disabled" class.
+     * Holds the filters sent with the first page so that the following pages use the same query.
+     * @type {Array}
      */
-    $scope.pagination.isDisabled = function (event) {
-        return angular.element(event.target).hasClass('disabled');
-    }
+    $scope.sentFilters = [];
 
     /**
      * Adds a filter and set the default value.
@@ -414,6 +388,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,22 +399,43 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Loads the next page of the current query. Invoked by the infinite-scroll directive.
      */
-    $scope.queryConferencesAll = function () {
-        var sendFilters = {
-            filters: []
+    $scope.loadMoreConferences = function () {
+        if ($scope.loading || !$scope.nextPageToken) {
+            return;
         }
-        for (var i = 0; i < $scope.filters.length; i++) {
-            var filter = $scope.filters[i];
-            if (filter.field && filter.operator && filter.value) {
-                sendFilters.filters.push({
-                    field: filter.field.enumValue,
-                    operator: filter.operator.enumValue,
-                    value: filter.value
-                });
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
+            $scope.getConferencesCreated($scope.nextPageToken);
+        }
+    };
+
+    /**
+     * Invokes the conference.queryConferences API.
+     *
+     * @param pageToken the token of the page to load, or undefined to load the first page.
+     */
+    $scope.queryConferencesAll = function (pageToken) {
+        if (!pageToken) {
+            $scope.sentFilters = [];
+            for (var i = 0; i < $scope.filters.length; i++) {
+                var filter = $scope.filters[i];
+                if (filter.field && filter.operator && filter.value) {
+                    $scope.sentFilters.push({
+                        field: filter.field.enumValue,
+                        operator: filter.operator.enumValue,
+                        value: filter.value
+                    });
+                }
             }
         }
+        var sendFilters = {
+            filters: $scope.sentFilters,
+            pageSize: $scope.pageSize,
+            pageToken: pageToken
+        }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
@@ -458,10 +454,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -470,10 +469,15 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.getConferencesCreated method.
+     *
+     * @param pageToken the token of the page to load, or undefined to load the first page.
      */
-    $scope.getConferencesCreated = function () {
+    $scope.getConferencesCreated = function (pageToken) {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated({
+            pageSize: $scope.pageSize,
+            pageToken: pageToken
+        }).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -495,10 +499,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -506,36 +513,30 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Retrieves the conferences to attend by calling the conference.getProfile method and
-     * invokes the conference.getConference method n times where n == the number of the conferences to attend.
+     * Retrieves the conferences to attend from the dashboard loaded by the conference.getDashboard method.
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
+        dashboard.load().then(function (result) {
+            // The request has succeeded.
+            $scope.conferences = result.conferencesToAttend || [];
+            $scope.loading = false;
+            $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
+            $scope.alertStatus = 'success';
+            $log.info($scope.messages);
+            $scope.submitted = true;
+        }, function (resp) {
+            // The request has failed.
+            var errorMessage = resp.error.message || '';
+            $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
+            $scope.alertStatus = 'warning';
+            $log.error($scope.messages);
+            $scope.submitted = true;
 
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.conferences = resp.result.items;
-                        $scope.loading = false;
-                        $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
-                    }
-                    $scope.submitted = true;
-                });
-            });
+            if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                oauth2Provider.showLoginModal();
+            }
+        });
     };
 });
 
@@ -547,7 +548,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS, responseCache, dashboard) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -559,9 +560,10 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        var params = {websafeConferenceKey: $routeParams.websafeConferenceKey};
+        gapi.client.conference.getConference(
+            responseCache.withEtag('getConference', params)
+        ).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -572,32 +574,29 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                     $scope.alertStatus = 'warning';
                     $log.error($scope.messages);
                 } else {
-                    // The request has succeeded.
+                    // The request has succeeded; notModified replies reuse the cached conference.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    $scope.conference = responseCache.resolve('getConference', params, resp.result);
                 }
             });
         });
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
-                    }
+        dashboard.load().then(function (result) {
+            $scope.loading = false;
+            var attending = result.profile.conferenceKeysToAttend || [];
+            for (var i = 0; i < attending.length; i++) {
+                if ($routeParams.websafeConferenceKey == attending[i]) {
+                    // The user is attending the conference.
+                    $scope.alertStatus = 'info';
+                    $scope.messages = 'You are attending this conference';
+                    $scope.isUserAttending = true;
                 }
-            });
+            }
+        }, function () {
+            // Failed to get a user profile.
+            $scope.loading = false;
         });
     };
 
@@ -626,6 +625,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     if (resp.result) {
                         // Register succeeded.
+                        dashboard.invalidate();
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
                         $scope.isUserAttending = true;
@@ -662,6 +662,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     if (resp.result) {
                         // Unregister succeeded.
+                        dashboard.invalidate();
                         $scope.messages = 'Unregistered from the conference';
                         $scope.alertStatus = 'success';
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable + 1;
@@ -691,7 +692,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
  * such as user authentications.
  *
  */
-conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider, dashboard) {
 
     /**
      * Returns if the viewLocation is the currently viewed page.
@@ -755,6 +756,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
      */
     $scope.signOut = function () {
         oauth2Provider.signOut();
+        dashboard.invalidate();
         $scope.alertStatus = 'success';
         $scope.rootMessages = 'Logged out';
     };
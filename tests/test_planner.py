@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+test_planner.py -- planned queries through the ConferenceApi endpoints
+
+Runs nonWorkshopSessionsBefore7, querySessions and queryConferences on
+the testbed stubs, with filters on date and time properties and with
+inequalities on several properties, and checks the results against the
+stored entities.
+
+usage: APPENGINE_SDK=PATH_TO_APPENGINE_SDK python tests/test_planner.py
+
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+from datetime import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def setupPath(sdk):
+    """Make the App Engine SDK and the app importable."""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('APPLICATION_ID', 'dev~test')
+
+setupPath(os.environ['APPENGINE_SDK'])
+
+import endpoints
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForm
+from models import Profile
+from models import Session
+from models import Speaker
+
+USER = 'user@example.com'
+
+
+def call(name, **fields):
+    """Call endpoint name of a ConferenceApi as USER, bypassing the
+    Endpoints request plumbing."""
+    endpoints.get_current_user = lambda: users.User(USER)
+    method = getattr(ConferenceApi, name).remote
+    return method.method(ConferenceApi(), method.request_type(**fields))
+
+
+def queryForm(field, operator, value):
+    return ConferenceQueryForm(field=field, operator=operator, value=value)
+
+
+class PlannedQueriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(consistency_policy=
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_user_stub()
+        ndb.get_context().clear_cache()
+
+        organizer = ndb.Key(Profile, USER)
+        Profile(key=organizer, displayName='User', mainEmail=USER).put()
+        speaker = Speaker(name='Ada').put()
+        self.conferences = ndb.put_multi([
+            Conference(parent=organizer, name='Conference %d' % month,
+                       organizerUserId=USER, month=month,
+                       maxAttendees=100 * month, seatsAvailable=100 * month)
+            for month in (1, 6, 11)])
+        conf_key = self.conferences[0]
+        self.sessions = dict((session.name, session) for session in [
+            Session(parent=conf_key, conferenceKey=conf_key, name=name,
+                    speakerKey=speaker, typeOfSession=kind, duration=1.0,
+                    date=day, startTime=start)
+            for name, kind, day, start in [
+                ('morning lecture', 'Lecture', date(2030, 1, 1), time(9, 0)),
+                ('morning workshop', 'Workshop', date(2030, 1, 1), time(9, 0)),
+                ('evening lecture', 'Lecture', date(2030, 1, 2), time(20, 0)),
+                ('late keynote', 'Keynote', date(2030, 1, 3), time(19, 0)),
+            ]])
+        ndb.put_multi(self.sessions.values())
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def names(self, forms):
+        return sorted(form.name for form in forms.items)
+
+    def testNonWorkshopSessionsBefore7(self):
+        self.assertEqual(self.names(call('nonWorkshopSessionsBefore7')),
+                         ['late keynote', 'morning lecture'])
+
+    def testQuerySessionsByDateAndStartTime(self):
+        forms = call('querySessions',
+            websafeConferenceKey=self.conferences[0].urlsafe(),
+            filters=[queryForm('DATE', 'GTEQ', '2030-01-02'),
+                     queryForm('START_TIME', 'GTEQ', '19:00')])
+        self.assertEqual(self.names(forms), ['evening lecture',
+                                             'late keynote'])
+
+    def testQuerySessionsByTypeAndStartTime(self):
+        forms = call('querySessions',
+            filters=[queryForm('TYPE', 'EQ', 'Lecture'),
+                     queryForm('START_TIME', 'LT', '12:00')])
+        self.assertEqual(self.names(forms), ['morning lecture'])
+
+    def testQueryConferencesWithTwoInequalities(self):
+        forms = call('queryConferences',
+            filters=[queryForm('MONTH', 'GT', '3'),
+                     queryForm('MAX_ATTENDEES', 'LT', '1000')])
+        self.assertEqual(self.names(forms), ['Conference 6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
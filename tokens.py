@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+tokens.py -- local verification of Google ID tokens
+
+An ID token is a JWT signed with RS256 by one of Google's rotating keys.
+verify() checks the signature against the published key set and the
+issuer, audience and expiry claims without calling tokeninfo.  The key
+set is fetched from CERTS_URL and kept in process and in memcache for
+as long as its Cache-Control header allows, so it is refreshed about
+once a day; an unknown key id forces one early refresh, which picks up
+a rotation before the old set expires.
+
+FakeKeySet signs tokens with a locally generated key and installs its
+key set in place of Google's, for tests that run offline.
+
+"""
+
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MEMCACHE_KEYSET_KEY = 'GOOGLE_JWKS'
+DEFAULT_KEYSET_TTL = 3600
+CLOCK_SKEW = 300  # seconds of clock difference tolerated on iat/exp
+MIN_REFRESH = 60  # seconds between refreshes forced by unknown key ids
+
+
+class InvalidToken(Exception):
+    """Raised when a token is malformed, badly signed or not valid now."""
+
+
+def looksLikeJwt(token):
+    return token.count('.') == 2
+
+
+def _b64decode(segment):
+    segment = str(segment)
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _toLong(segment):
+    return long(binascii.hexlify(_b64decode(segment)), 16)
+
+
+def _fromLong(value):
+    digits = '%x' % value
+    return _b64encode(binascii.unhexlify('0' * (len(digits) % 2) + digits))
+
+
+# - - - key set - - - - - - - - - - - - - - - - - - - -
+
+_lock = threading.Lock()
+_keys = {}         # kid -> RSA key; replaced whole, never mutated
+_expires = [0]     # when the in-process key set must be re-read
+_forced = [0]      # when an unknown key id last forced a refresh
+
+
+def _maxAge(headers):
+    match = re.search(r'max-age=(\d+)', headers.get('cache-control', ''))
+    return int(match.group(1)) if match else DEFAULT_KEYSET_TTL
+
+
+def _fetchKeySet():
+    """Return (jwks, expires) from memcache, or else from CERTS_URL."""
+    cached = memcache.get(MEMCACHE_KEYSET_KEY)
+    if cached is not None:
+        return cached
+    try:
+        resp = urlfetch.fetch(CERTS_URL, deadline=5)
+    except (urlfetch.DownloadError, urlfetch.DeadlineExceededError) as e:
+        raise InvalidToken('Cannot fetch signing keys: %s' % e)
+    if resp.status_code != 200:
+        raise InvalidToken('Cannot fetch signing keys: %d' % resp.status_code)
+    try:
+        jwks = json.loads(resp.content)
+    except ValueError:
+        raise InvalidToken('Cannot parse signing keys')
+    ttl = _maxAge(resp.headers)
+    expires = time.time() + ttl
+    memcache.set(MEMCACHE_KEYSET_KEY, (jwks, expires), time=ttl)
+    return jwks, expires
+
+
+def installKeySet(jwks, expires):
+    """Use jwks as the key set in this process until expires."""
+    global _keys
+    keys = dict((jwk['kid'], RSA.construct((_toLong(jwk['n']),
+                                             _toLong(jwk['e']))))
+                for jwk in jwks['keys'] if jwk.get('kty') == 'RSA')
+    with _lock:
+        # one assignment, so readers without the lock never see a
+        # partly installed set
+        _keys = keys
+        _expires[0] = expires
+
+
+def _refresh(force=False):
+    if force:
+        memcache.delete(MEMCACHE_KEYSET_KEY)
+    installKeySet(*_fetchKeySet())
+
+
+def _getKey(kid):
+    if _expires[0] < time.time():
+        _refresh()
+    key = _keys.get(kid)
+    if key is None and _forced[0] + MIN_REFRESH < time.time():
+        # keys rotated since the set was cached
+        _forced[0] = time.time()
+        _refresh(force=True)
+        key = _keys.get(kid)
+    if key is None:
+        raise InvalidToken('Unknown signing key: %s' % kid)
+    return key
+
+
+# - - - verification - - - - - - - - - - - - - - - - - -
+
+def verify(token, audiences, now=None):
+    """Return the claims of a valid Google ID token for one of
+    audiences; raise InvalidToken otherwise."""
+    try:
+        header_b64, claims_b64, signature_b64 = str(token).split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError):
+        raise InvalidToken('Malformed token')
+
+    if header.get('alg') != 'RS256':
+        raise InvalidToken('Unsupported algorithm: %s' % header.get('alg'))
+    digest = SHA256.new('%s.%s' % (header_b64, claims_b64))
+    if not PKCS1_v1_5.new(_getKey(header.get('kid'))).verify(
+            digest, signature):
+        raise InvalidToken('Bad signature')
+
+    now = now or time.time()
+    if claims.get('iss') not in ISSUERS:
+        raise InvalidToken('Wrong issuer: %s' % claims.get('iss'))
+    if claims.get('aud') not in audiences:
+        raise InvalidToken('Wrong audience: %s' % claims.get('aud'))
+    if int(claims.get('exp', 0)) < now - CLOCK_SKEW:
+        raise InvalidToken('Token expired')
+    if int(claims.get('iat', 0)) > now + CLOCK_SKEW:
+        raise InvalidToken('Token issued in the future')
+    return claims
+
+
+class FakeKeySet(object):
+    """FakeKeySet -- signs ID tokens with a throwaway key, for tests"""
+
+    def __init__(self, kid='fake', bits=1024):
+        self.kid = kid
+        self._key = RSA.generate(bits)
+
+    def jwks(self):
+        return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig',
+                          'kid': self.kid, 'n': _fromLong(self._key.n),
+                          'e': _fromLong(self._key.e)}]}
+
+    def install(self, ttl=DEFAULT_KEYSET_TTL):
+        """Make verify() use this key set instead of Google's."""
+        installKeySet(self.jwks(), time.time() + ttl)
+
+    def mint(self, sub, aud, email=None, lifetime=3600, **claims):
+        """Return a signed ID token for user sub and audience aud."""
+        now = int(time.time())
+        claims.update({'iss': ISSUERS[1], 'sub': sub, 'aud': aud,
+                       'iat': now, 'exp': now + lifetime})
+        if email:
+            claims['email'] = email
+        signing_input = '%s.%s' % (
+            _b64encode(json.dumps({'alg': 'RS256', 'typ': 'JWT',
+                                   'kid': self.kid})),
+            _b64encode(json.dumps(claims)))
+        signature = PKCS1_v1_5.new(self._key).sign(SHA256.new(signing_input))
+        return '%s.%s' % (signing_input, _b64encode(signature))
@@ -1,11 +1,57 @@
+import hashlib
 import json
 import os
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+import tokens
+from cache import LRUCache
+from settings import ANDROID_AUDIENCE
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+from settings import TOKEN_CACHE_SIZE
+from settings import TOKEN_CACHE_TTL
+from settings import WEB_CLIENT_ID
+
+MEMCACHE_TOKEN_KEY = 'TOKEN:%s'
+AUDIENCES = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID,
+             ANDROID_AUDIENCE)
+
+_tokens = LRUCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def _lookupToken(token, token_type):
+    """Return (user_id, lifetime) for token: verified locally when it is
+    an ID token, else through the tokeninfo endpoint."""
+    if token_type == 'id_token' and tokens.looksLikeJwt(token):
+        try:
+            claims = tokens.verify(token, AUDIENCES)
+        except tokens.InvalidToken:
+            return '', 0
+        return claims['sub'], int(claims['exp'] - time.time())
+
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    user = {}
+    wait = 1
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            break
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+                   % ('access_token', token))
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return user.get('user_id', ''), int(user.get('expires_in', 0))
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -17,22 +63,21 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        # tokens are cached by hash, never beyond their own expiry
+        token_hash = hashlib.sha256('%s:%s' % (token_type, token)).hexdigest()
+        cached = _tokens.get(token_hash) or \
+            memcache.get(MEMCACHE_TOKEN_KEY % token_hash)
+        if cached and cached[1] > time.time():
+            _tokens.set(token_hash, cached)
+            return cached[0]
+
+        user_id, lifetime = _lookupToken(token, token_type)
+        if user_id and lifetime > 0:
+            cached = (user_id, time.time() + lifetime)
+            memcache.set(MEMCACHE_TOKEN_KEY % token_hash, cached,
+                         time=min(lifetime, TOKEN_CACHE_TTL))
+            _tokens.set(token_hash, cached)
+        return user_id
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm